@@ -0,0 +1,566 @@
+# async_main.py
+"""Асинхронный режим бота: AsyncTeleBot и асинхронные сессии SQLAlchemy.
+
+Обработчики — корутины, поэтому медленный отчёт одного пользователя не
+задерживает обновления остальных. Логика общая с синхронным режимом (services.py).
+"""
+import asyncio
+import configparser
+import logging
+import os
+from contextlib import closing
+from datetime import datetime, timedelta
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Message, CallbackQuery
+from db import SessionLocal, get_async_engine, get_async_session_factory, setup_database
+from write_pipeline import TransactionWriter
+from state_store import create_state_store
+from charts import ChartBusyError, create_chart_renderer
+from metrics import configure_metrics, instrumented
+from reports import NO_DATA_TEXT
+from keyboards import (create_keyboard, create_period_keyboard, HELP_TEXT, REGISTERED_TEXT, ADD_CATEGORY_TEXT,
+                       IMPORT_TEXT, MAX_IMPORT_FILE_SIZE, CHART_CALLBACK_PREFIX, create_chart_keyboard,
+                       parse_chart_callback)
+import exporter
+import importer
+import recurring
+import services
+from services import DATE_FORMAT
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Заполняются в create_app(): импорт модуля не читает настройки и не открывает базу
+config = None
+bot = None
+transaction_writer = None
+report_states = None
+chart_renderer = None
+scheduler = None
+event_loop = None
+CHART_TIMEOUT = 60
+
+
+def open_session():
+    return get_async_session_factory()()
+
+
+async def get_user(session, message):
+    """Внутренний id пользователя; при попадании в кэш база не запрашивается"""
+    user_id = await session.run_sync(services.find_user_id, message.from_user.id)
+    if not user_id:
+        await bot.reply_to(message, "⚠️ Сначала нужно зарегистрироваться командой /start",
+                           reply_markup=create_keyboard())
+        return None
+    return user_id
+
+
+async def call_state_store(method, *args):
+    """Вызов хранилища состояний; обращения к базе выносятся из цикла событий в поток"""
+    if report_states.blocking:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+@instrumented
+async def handle_start(message: Message):
+    try:
+        async with open_session() as session:
+            if await session.run_sync(services.register_user, message.from_user):
+                await bot.reply_to(message, REGISTERED_TEXT, reply_markup=create_keyboard())
+            else:
+                await show_help(message)
+    except Exception as e:
+        logger.error(f"Ошибка в /start: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка при регистрации. Попробуй снова.",
+                           reply_markup=create_keyboard())
+
+
+async def show_help(message: Message):
+    await bot.reply_to(message, HELP_TEXT, reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_help(message: Message):
+    await show_help(message)
+
+
+@instrumented
+async def handle_add_category(message: Message):
+    # Шаг хранится вместе с шагами мастера отчёта, как и в main.py
+    await call_state_store(report_states.set, message.from_user.id, {'step': 'add_category'})
+    await bot.reply_to(message, ADD_CATEGORY_TEXT)
+
+
+async def is_adding_category(message: Message):
+    """Ответ на /add_category ('трата аптека') иначе забрал бы обработчик транзакций"""
+    if not (message.text and len(message.text.split()) == 2 and
+            message.text.split()[0].lower() in services.TYPE_MAP):
+        return False
+    state = await call_state_store(report_states.get, message.from_user.id)
+    return bool(state) and state.get('step') == 'add_category'
+
+
+@instrumented
+async def save_new_category(message: Message, state: dict = None):
+    await call_state_store(report_states.delete, message.from_user.id)
+    try:
+        async with open_session() as session:
+            user_id = await get_user(session, message)
+            if not user_id:
+                return
+
+            reply = await session.run_sync(services.add_category, user_id, message.text)
+            await bot.reply_to(message, reply, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении категории: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка при добавлении категории. Попробуй снова.",
+                           reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_transaction(message: Message):
+    try:
+        async with open_session() as session:
+            user_id = await get_user(session, message)
+            if not user_id:
+                return
+
+            # Если нажата кнопка, просим ввести данные
+            if message.text.strip().lower() in ['добавить трату', 'добавить доход']:
+                example = "трата 300 продукты" if "трату" in message.text.lower() else "доход 50000 зарплата"
+                await bot.reply_to(message, f"Введи данные в формате:\n{example}")
+                return
+
+            if transaction_writer:
+                row, reply = await session.run_sync(services.prepare_transaction, user_id, message.text)
+                if row:
+                    # Подтверждаем только после коммита пачки, не блокируя цикл событий
+                    month_total = await asyncio.wrap_future(transaction_writer.submit(row))
+                    reply = await session.run_sync(services.with_budget_alert, row, month_total, reply)
+            else:
+                reply = await session.run_sync(services.add_transaction, user_id, message.text)
+            await bot.reply_to(message, reply, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении транзакции: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка при сохранении транзакции. Попробуй снова.",
+                           reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_import(message: Message):
+    await bot.reply_to(message, IMPORT_TEXT, reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_import_document(message: Message):
+    try:
+        async with open_session() as session:
+            user_id = await get_user(session, message)
+        if not user_id:
+            return
+
+        if message.document.file_size and message.document.file_size > MAX_IMPORT_FILE_SIZE:
+            await bot.reply_to(message, "❌ Файл больше 20 МБ, раздели его на части.",
+                               reply_markup=create_keyboard())
+            return
+
+        status = await bot.reply_to(message, "⏳ Импорт начат…")
+        loop = asyncio.get_running_loop()
+        last_update = [loop.time()]
+
+        def progress(processed):
+            # Вызывается из потока импорта; сообщение обновляется не чаще раза в 3 секунды
+            if loop.time() - last_update[0] >= 3:
+                last_update[0] = loop.time()
+                asyncio.run_coroutine_threadsafe(
+                    bot.edit_message_text(f"⏳ Обработано строк: {processed}", status.chat.id, status.message_id),
+                    loop
+                )
+
+        # Импорт читает файл и пишет в базу синхронно, поэтому выполняется в отдельном потоке
+        create_missing = 'создать' in (message.caption or '').lower()
+        url = await bot.get_file_url(message.document.file_id)
+        result = await asyncio.to_thread(importer.import_from_url, SessionLocal, url, user_id,
+                                         create_missing, progress)
+        logger.info(f"Импорт для пользователя {user_id}: добавлено {result.imported}, ошибок {result.failed}")
+        await bot.reply_to(message, importer.format_import_result(result), reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при импорте: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка при импорте. Попробуй снова.",
+                           reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_report(message: Message):
+    try:
+        await call_state_store(report_states.set, message.from_user.id, {
+            'step': 'select_period_type',
+            'start_date': None,
+            'end_date': None
+        })
+        await bot.reply_to(message, "📆 Выбери тип периода для отчёта:", reply_markup=create_period_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при формировании отчёта: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_trend(message: Message):
+    try:
+        async with open_session() as session:
+            user_id = await get_user(session, message)
+            if user_id:
+                args = message.text.lower().split()[1:]
+                report = await session.run_sync(services.build_trend_report, user_id, args,
+                                                datetime.now().date())
+                await bot.reply_to(message, report, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при формировании динамики: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка при формировании отчёта. Попробуй позже.",
+                           reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_budget(message: Message):
+    try:
+        async with open_session() as session:
+            user_id = await get_user(session, message)
+            if user_id:
+                args = message.text.lower().split()[1:]
+                reply = await session.run_sync(services.handle_budget_command, user_id, args,
+                                               datetime.now().date())
+                await bot.reply_to(message, reply, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при работе с бюджетом: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_recurring(message: Message):
+    try:
+        async with open_session() as session:
+            user_id = await get_user(session, message)
+            if user_id:
+                text = message.text.split(maxsplit=1)[1] if len(message.text.split()) > 1 else ''
+                reply, job = await session.run_sync(recurring.recurring_command, user_id, text, datetime.now())
+                if job and scheduler:
+                    scheduler.schedule(*job)
+                await bot.reply_to(message, reply, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при работе с регулярными операциями: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_weekly(message: Message):
+    try:
+        async with open_session() as session:
+            user_id = await get_user(session, message)
+            if user_id:
+                reply, job = await session.run_sync(recurring.weekly_command, user_id, datetime.now())
+                if job and scheduler:
+                    scheduler.schedule(*job)
+                await bot.reply_to(message, reply, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при настройке сводки: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_export(message: Message):
+    try:
+        args = message.text.lower().split()[1:]
+        fmt = 'json' if 'json' in args else 'csv'
+        await call_state_store(report_states.set, message.from_user.id, {
+            'step': 'select_period_type',
+            'start_date': None,
+            'end_date': None,
+            'export': {'format': fmt, 'compress': 'gz' in args}
+        })
+
+        await bot.reply_to(message, "📆 Выбери период для выгрузки:", reply_markup=create_period_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_period_type_selection(message: Message, state: dict):
+    try:
+        user_id = message.from_user.id
+        period_type = message.text.strip().lower()
+
+        if period_type == 'назад':
+            await call_state_store(report_states.delete, user_id)
+            await bot.reply_to(message, "Возвращаемся в главное меню", reply_markup=create_keyboard())
+            return
+
+        if period_type == 'произвольный период':
+            state['step'] = 'select_start_date'
+            await call_state_store(report_states.set, user_id, state)
+            await bot.reply_to(message, "📅 Введи начальную дату в формате ГГГГ-ММ-ДД (например, 2025-07-01):")
+            return
+
+        bounds = services.period_bounds(period_type, datetime.now().date())
+        if bounds is None:
+            await bot.reply_to(message, "❌ Неизвестный тип периода. Попробуй еще раз.")
+            return
+
+        state['start_date'], state['end_date'] = bounds
+        state['step'] = 'generate_report'
+        await finish_period_selection(message, state)
+
+    except Exception as e:
+        logger.error(f"Ошибка при выборе типа периода: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_start_date_selection(message: Message, state: dict):
+    try:
+        try:
+            state['start_date'] = datetime.strptime(message.text, DATE_FORMAT).date()
+            state['step'] = 'select_end_date'
+            await call_state_store(report_states.set, message.from_user.id, state)
+            await bot.reply_to(message, "📅 Введи конечную дату в формате ГГГГ-ММ-ДД (например, 2025-07-15):")
+        except ValueError:
+            await bot.reply_to(message, "❌ Неверный формат даты. Используй формат ГГГГ-ММ-ДД (например, 2025-07-15)")
+
+    except Exception as e:
+        logger.error(f"Ошибка при выборе начальной даты: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
+
+
+@instrumented
+async def handle_end_date_selection(message: Message, state: dict):
+    try:
+        try:
+            end_date = datetime.strptime(message.text, DATE_FORMAT).date()
+            state['end_date'] = end_date + timedelta(days=1)  # Чтобы включить весь конечный день
+            state['step'] = 'generate_report'
+            await finish_period_selection(message, state)
+        except ValueError:
+            await bot.reply_to(message, "❌ Неверный формат даты. Используй формат ГГГГ-ММ-ДД (например, 2025-07-15)")
+
+    except Exception as e:
+        logger.error(f"Ошибка при выборе конечной даты: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
+
+
+@instrumented
+async def generate_report(message: Message, state: dict):
+    try:
+        async with open_session() as session:
+            user_id = await get_user(session, message)
+            if user_id:
+                report = await session.run_sync(services.build_report, user_id,
+                                                state.get('start_date'), state.get('end_date'))
+                await bot.reply_to(message, report, reply_markup=create_keyboard())
+                if report != NO_DATA_TEXT:
+                    await bot.send_message(message.chat.id, "Показать графиком:",
+                                           reply_markup=create_chart_keyboard(state.get('start_date'),
+                                                                              state.get('end_date')))
+
+    except Exception as e:
+        logger.error(f"Ошибка при формировании отчёта: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка при формировании отчёта. Попробуй позже.",
+                           reply_markup=create_keyboard())
+
+    # Очищаем состояние
+    await call_state_store(report_states.delete, message.from_user.id)
+
+
+@instrumented
+async def handle_chart(call: CallbackQuery):
+    try:
+        kind, start_date, end_date = parse_chart_callback(call.data)
+        async with open_session() as session:
+            user_id = await session.run_sync(services.find_user_id, call.from_user.id)
+            chart = await session.run_sync(services.prepare_chart, user_id, kind, start_date,
+                                           end_date) if user_id else None
+        if chart is None:
+            await bot.answer_callback_query(call.id, "📭 Нет данных для графика")
+            return
+
+        key, render, args = chart
+        # Та же картинка уже загружалась: отправляем по file_id без отрисовки и загрузки
+        file_id = services.chart_file_ids.get(key)
+        if file_id:
+            await bot.send_photo(call.message.chat.id, file_id)
+        else:
+            png = await asyncio.wait_for(asyncio.wrap_future(chart_renderer.submit(render, *args)),
+                                         CHART_TIMEOUT)
+            sent = await bot.send_photo(call.message.chat.id, png)
+            services.chart_file_ids.set(key, sent.photo[-1].file_id)
+        await bot.answer_callback_query(call.id)
+    except ChartBusyError:
+        await bot.answer_callback_query(call.id, "⏳ Сейчас рисуется много графиков, попробуй через минуту")
+    except Exception as e:
+        logger.error(f"Ошибка при построении графика: {str(e)}")
+        await bot.answer_callback_query(call.id, "❌ Не удалось построить график")
+
+
+def export_transactions(user_id, start_date, end_date, options):
+    # Выгрузка читает курсор и пишет файл синхронно, поэтому идёт в отдельном потоке со своей сессией
+    with closing(SessionLocal()) as session:
+        return exporter.export_transactions(session, user_id, start_date, end_date,
+                                            options['format'], options['compress'])
+
+
+@instrumented
+async def generate_export(message: Message, state: dict):
+    try:
+        async with open_session() as session:
+            user_id = await get_user(session, message)
+        if user_id:
+            result = await asyncio.to_thread(export_transactions, user_id, state.get('start_date'),
+                                             state.get('end_date'), state['export'])
+            try:
+                await send_export(message, result)
+            finally:
+                os.remove(result.path)
+
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке: {str(e)}")
+        await bot.reply_to(message, "❌ Произошла ошибка при выгрузке. Попробуй позже.",
+                           reply_markup=create_keyboard())
+
+    await call_state_store(report_states.delete, message.from_user.id)
+
+
+async def send_export(message: Message, result):
+    if not result.count:
+        await bot.reply_to(message, NO_DATA_TEXT, reply_markup=create_keyboard())
+    elif result.size > exporter.MAX_SEND_FILE_SIZE:
+        await bot.reply_to(message, "❌ Выгрузка больше 50 МБ, выбери период короче.",
+                           reply_markup=create_keyboard())
+    else:
+        with open(result.path, 'rb') as document:
+            await bot.send_document(message.chat.id, document, visible_file_name=result.filename,
+                                    caption=f"📤 Транзакций: {result.count}", reply_markup=create_keyboard())
+
+
+async def finish_period_selection(message: Message, state: dict):
+    """Последний шаг мастера: отчёт или выгрузка за выбранный период"""
+    if state.get('export'):
+        await generate_export(message, state)
+    else:
+        await generate_report(message, state)
+
+
+# Шаги диалогов (мастер отчёта, новая категория): шаг из состояния -> обработчик
+REPORT_STEPS = {
+    'add_category': save_new_category,
+    'select_period_type': handle_period_type_selection,
+    'select_start_date': handle_start_date_selection,
+    'select_end_date': handle_end_date_selection,
+}
+
+
+@instrumented
+async def handle_other_messages(message: Message):
+    """Обработчик для любых других сообщений: шаги мастера отчёта и неизвестный ввод"""
+    if not message.text:
+        return
+
+    state = await call_state_store(report_states.get, message.from_user.id)
+    step_handler = REPORT_STEPS.get(state.get('step')) if state else None
+    if step_handler:
+        await step_handler(message, state)
+    elif message.text.startswith('/'):
+        await bot.reply_to(message, "❌ Неизвестная команда. Используй /help для списка команд.",
+                           reply_markup=create_keyboard())
+    else:
+        await bot.reply_to(message, "Я тебя не понимаю 😢\nИспользуй кнопки или команду /help",
+                           reply_markup=create_keyboard())
+
+
+def register_handlers(bot):
+    """Обработчики бота; проверяются по порядку регистрации, handle_other_messages — последним"""
+    bot.register_message_handler(handle_start, commands=['start'])
+    bot.register_message_handler(handle_help, commands=['help'])
+    bot.register_message_handler(handle_help, func=lambda m: m.text and m.text.strip().lower() == 'помощь')
+    bot.register_message_handler(handle_add_category, commands=['add_category'])
+    bot.register_message_handler(handle_add_category,
+                                 func=lambda m: m.text and m.text.strip().lower() == 'добавить категорию')
+    bot.register_message_handler(save_new_category, func=is_adding_category)
+    bot.register_message_handler(
+        handle_transaction,
+        func=lambda m: m.text and m.text.strip().lower() in ['добавить трату', 'добавить доход'] or
+                       (len(m.text.split()) > 0 and m.text.split()[0].lower() in ['трата', 'доход'])
+    )
+    bot.register_message_handler(handle_import, commands=['import'])
+    bot.register_message_handler(handle_import_document, content_types=['document'])
+    bot.register_message_handler(handle_report, commands=['report'])
+    bot.register_message_handler(handle_report, func=lambda m: m.text and m.text.strip().lower() == 'отчёт')
+    bot.register_message_handler(handle_trend, commands=['trend'])
+    bot.register_message_handler(handle_budget, commands=['budget'])
+    bot.register_message_handler(handle_recurring, commands=['recurring'])
+    bot.register_message_handler(handle_weekly, commands=['weekly'])
+    bot.register_message_handler(handle_export, commands=['export'])
+    bot.register_callback_query_handler(
+        handle_chart, func=lambda call: call.data and call.data.startswith(CHART_CALLBACK_PREFIX)
+    )
+    bot.register_message_handler(handle_other_messages, func=lambda m: True)
+
+
+def create_app(config_path='settings.ini'):
+    """Фабрика приложения: настройки, база с проверкой версии схемы, бот и обработчики"""
+    global config, bot, transaction_writer, report_states, chart_renderer, scheduler
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    engine = setup_database(config_path)
+    bot = AsyncTeleBot(config["TOKEN"]['token'])
+
+    # Групповая запись транзакций, см. [PIPELINE] в settings.ini
+    transaction_writer = None
+    if config.getboolean('PIPELINE', 'enabled', fallback=False):
+        transaction_writer = TransactionWriter(
+            SessionLocal,
+            max_batch=config.getint('PIPELINE', 'batch_size', fallback=200),
+            max_latency=config.getint('PIPELINE', 'max_latency_ms', fallback=5) / 1000,
+            on_commit=services.transactions_committed
+        )
+
+    # Время жизни кэшей, которые не видят записей других процессов бота: [CACHE]
+    services.configure_caches(config)
+
+    # Состояние мастера отчёта: [STATE] backend = memory | sqlite
+    report_states = create_state_store(config, SessionLocal)
+    # Отрисовка графиков в пуле процессов, см. [CHARTS] в settings.ini
+    chart_renderer = create_chart_renderer(config)
+
+    # Метрики, см. [METRICS]; синхронный движок используют импорт и выгрузка в потоках
+    configure_metrics(config, bot, get_async_engine().sync_engine, engine, caches=services.cache_stats)
+
+    # Регулярные операции и сводки: [SCHEDULER]; поток планировщика отправляет
+    # уведомления через цикл событий, см. main()
+    scheduler = None
+    if config.getboolean('SCHEDULER', 'enabled', fallback=True):
+        scheduler = recurring.create_scheduler(config, SessionLocal, send_from_thread)
+
+    register_handlers(bot)
+    return bot
+
+
+def send_from_thread(chat_id, text):
+    """Отправка из потока планировщика: корутина выполняется в цикле событий бота"""
+    return asyncio.run_coroutine_threadsafe(bot.send_message(chat_id, text), event_loop).result()
+
+
+async def main(config_path='settings.ini'):
+    global event_loop
+    create_app(config_path)
+    if scheduler:
+        event_loop = asyncio.get_running_loop()
+        scheduler.start()
+    logger.info("Бот запущен в асинхронном режиме. Ожидаю команды...")
+    await bot.infinity_polling()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+# benchmarks/bench_report.py
+"""Время построения отчёта: прежние два запроса по сырым транзакциям против build_report_data.
+
+Запуск: python benchmarks/bench_report.py [--rows 500000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, insert, select
+from sqlite_profile import ENGINE_PROFILES, create_db_engine
+from models import Base, User, Category, CategoryType, Transaction
+from reports import build_report_data
+from rollups import rebuild_rollups
+
+
+def seed(engine, rows, users=10):
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'id': i, 'telegram_id': i} for i in range(1, users + 1)])
+        conn.execute(insert(Category), [
+            {'id': (u - 1) * 20 + c, 'user_id': u, 'name': f"категория{c}",
+             'type': CategoryType.income if c <= 3 else CategoryType.expense}
+            for u in range(1, users + 1) for c in range(1, 21)
+        ])
+        start = datetime.now() - timedelta(days=5 * 365)
+        for offset in range(0, rows, 20000):
+            chunk = []
+            for _ in range(min(20000, rows - offset)):
+                user_id = random.randint(1, users)
+                chunk.append({
+                    'user_id': user_id,
+                    'category_id': (user_id - 1) * 20 + random.randint(1, 20),
+                    'amount': random.randint(1000, 500000),  # копейки
+                    'date': start + timedelta(minutes=random.randint(0, 5 * 365 * 24 * 60)),
+                })
+            conn.execute(insert(Transaction), chunk)
+        rebuild_rollups(conn)
+
+
+def legacy_report(conn, user_id, start, end):
+    """Прежняя схема: суммы по категориям и отдельный COUNT по сырым строкам"""
+    query = select(Category.name, Category.type, func.sum(Transaction.amount)).join(
+        Category, Category.id == Transaction.category_id
+    ).where(Transaction.user_id == user_id)
+    count = select(func.count()).select_from(Transaction).where(Transaction.user_id == user_id)
+    if start and end:
+        query = query.where(Transaction.date >= start, Transaction.date < end)
+        count = count.where(Transaction.date >= start, Transaction.date < end)
+    conn.execute(query.group_by(Category.name, Category.type)).all()
+    conn.execute(count).scalar()
+
+
+def timed(repeat, fn, *args):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000, help='транзакций у 10 пользователей')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    periods = {
+        'месяц': (today.replace(day=1), today + timedelta(days=1)),
+        'год': (today.replace(month=1, day=1), today + timedelta(days=1)),
+        'всё время': (None, None),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(os.path.join(tmp, 'report.db'), ENGINE_PROFILES['performance'])
+        Base.metadata.create_all(engine)
+        seed(engine, args.rows)
+
+        with engine.connect() as conn:
+            for title, (start, end) in periods.items():
+                legacy = timed(args.repeat, legacy_report, conn, 1, start, end)
+                current = timed(args.repeat, build_report_data, conn, 1, start, end)
+                print(f"{title:10} было: {legacy:8.2f} мс  стало: {current:8.2f} мс  "
+                      f"ускорение: {legacy / current:6.1f}x")
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
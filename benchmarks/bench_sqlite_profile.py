@@ -0,0 +1,116 @@
+# benchmarks/bench_sqlite_profile.py
+"""Запись транзакций во время тяжёлых отчётов: профиль legacy против performance (WAL).
+
+Запуск: python benchmarks/bench_sqlite_profile.py [--rows 300000] [--readers 4] [--seconds 5]
+Для каждого профиля создаётся отдельная временная база.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import sessionmaker
+from sqlite_profile import ENGINE_PROFILES, create_db_engine
+from models import Base, User, Category, CategoryType, Transaction
+from services import save_transaction
+
+
+def seed(factory, rows):
+    with closing(factory()) as session:
+        session.add(User(id=1, telegram_id=1))
+        session.add_all([
+            Category(id=i, user_id=1, name=f"категория{i}", type=CategoryType.expense) for i in range(1, 21)
+        ])
+        start = datetime.now() - timedelta(days=3 * 365)
+        chunk = []
+        for i in range(rows):
+            chunk.append({
+                'user_id': 1,
+                'category_id': random.randint(1, 20),
+                'amount': random.randint(1000, 500000),  # копейки
+                'date': start + timedelta(minutes=random.randint(0, 3 * 365 * 24 * 60)),
+            })
+            if len(chunk) == 10000:
+                session.execute(insert(Transaction), chunk)
+                chunk = []
+        if chunk:
+            session.execute(insert(Transaction), chunk)
+        session.commit()
+
+
+def run_profile(path, profile, rows, readers, seconds):
+    engine = create_db_engine(path, ENGINE_PROFILES[profile], pool_size=readers + 2)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    seed(factory, rows)
+
+    stop = threading.Event()
+    reports = [0]
+
+    def reader():
+        # Отчёт по сырым строкам без агрегатов — худший случай для блокировок
+        while not stop.is_set():
+            with closing(factory()) as session:
+                session.query(Transaction.category_id, func.sum(Transaction.amount)).filter(
+                    Transaction.user_id == 1
+                ).group_by(Transaction.category_id).all()
+            reports[0] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        row = {'user_id': 1, 'category_id': 1, 'amount': 10000, 'date': datetime.now()}
+        started = time.perf_counter()
+        try:
+            with closing(factory()) as session:
+                save_transaction(session, row)
+            latencies.append(time.perf_counter() - started)
+        except Exception:
+            errors += 1
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    return latencies, errors, reports[0]
+
+
+def describe(profile, latencies, errors, reports, seconds):
+    latencies = sorted(latencies) or [0.0]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{profile:12} записей/с: {len(latencies) / seconds:8.1f}  "
+          f"p50: {statistics.median(latencies) * 1000:7.1f} мс  "
+          f"p99: {p99 * 1000:7.1f} мс  max: {latencies[-1] * 1000:7.1f} мс  "
+          f"ошибок: {errors}  отчётов: {reports}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=300000, help='транзакций в истории')
+    parser.add_argument('--readers', type=int, default=4, help='потоков, строящих отчёты')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in ('legacy', 'performance'):
+            result = run_profile(os.path.join(tmp, f"{profile}.db"), profile,
+                                 args.rows, args.readers, args.seconds)
+            describe(profile, *result, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/bench_startup.py
+"""Время старта процесса бота: импорт модулей, create_app на новой и на актуальной базе.
+
+Каждый замер — в отдельном процессе интерпретатора, как при перезапуске
+воркера. Для сравнения замеряется прежнее поведение: create_all и все шаги
+миграций при каждом старте (upgrade_schema) на базе с --rows транзакциями.
+
+Запуск: python benchmarks/bench_startup.py [--rows 200000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SETTINGS = "[TOKEN]\ntoken = 123456:STARTUP\n\n[DATABASE]\npath = startup.db\nprofile = performance\n"
+
+# Код замеров: выполняется в новом процессе, печатает время в секундах
+PRELUDE = f"import sys, time\nsys.path.insert(0, {ROOT!r})\nstarted = time.perf_counter()\n"
+SCENARIOS = {
+    'импорт main': "import main\n",
+    'импорт async_main': "import async_main\n",
+    'create_app': "import main\nmain.create_app()\n",
+    'старт до изменений': (
+        "import main, db, migrations\n"
+        "migrations.upgrade_schema(db.get_engine())\n"
+        "main.create_app()\n"
+    ),
+}
+
+
+def seed(path, rows, users=100):
+    from sqlalchemy import insert
+    from sqlite_profile import ENGINE_PROFILES, create_db_engine
+    from models import Base, User, Category, CategoryType, Transaction
+    from migrations import upgrade_schema
+
+    engine = create_db_engine(path, ENGINE_PROFILES['performance'])
+    Base.metadata.create_all(engine)
+    start = datetime.now() - timedelta(days=3 * 365)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'id': i, 'telegram_id': i} for i in range(1, users + 1)])
+        conn.execute(insert(Category), [
+            {'id': (u - 1) * 10 + c, 'user_id': u, 'name': f"категория{c}",
+             'type': CategoryType.income if c <= 2 else CategoryType.expense}
+            for u in range(1, users + 1) for c in range(1, 11)
+        ])
+        for offset in range(0, rows, 20000):
+            chunk = []
+            for _ in range(min(20000, rows - offset)):
+                user_id = random.randint(1, users)
+                chunk.append({
+                    'user_id': user_id,
+                    'category_id': (user_id - 1) * 10 + random.randint(1, 10),
+                    'amount': random.randint(1000, 500000),
+                    'date': start + timedelta(minutes=random.randint(0, 3 * 365 * 24 * 60)),
+                })
+            conn.execute(insert(Transaction), chunk)
+    upgrade_schema(engine)
+    engine.dispose()
+
+
+def measure(directory, code, repeat):
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, '-c', PRELUDE + code + "print(time.perf_counter() - started)\n"],
+            cwd=directory, capture_output=True, text=True, check=True
+        )
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='транзакций в базе')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'settings.ini'), 'w', encoding='utf-8') as f:
+            f.write(SETTINGS)
+        database = os.path.join(tmp, 'startup.db')
+
+        results['импорт main'] = measure(tmp, SCENARIOS['импорт main'], args.repeat)
+        results['импорт async_main'] = measure(tmp, SCENARIOS['импорт async_main'], args.repeat)
+        if os.path.exists(database):
+            raise SystemExit("Импорт модулей создал файл базы")
+
+        # Новая база: каждый прогон создаёт схему с нуля
+        new_db = []
+        for _ in range(args.repeat):
+            new_db.append(measure(tmp, SCENARIOS['create_app'], 1))
+            os.remove(database)
+        results['create_app, новая база'] = statistics.median(new_db)
+
+        seed(database, args.rows)
+        results[f'create_app, база {args.rows} строк'] = measure(tmp, SCENARIOS['create_app'], args.repeat)
+        results[f'до изменений, база {args.rows} строк'] = measure(tmp, SCENARIOS['старт до изменений'],
+                                                                   args.repeat)
+
+    for title, elapsed in results.items():
+        print(f"{title:36} {elapsed:8.1f} мс")
+
+
+if __name__ == '__main__':
+    main()
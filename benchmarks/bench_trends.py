@@ -0,0 +1,105 @@
+# benchmarks/bench_trends.py
+"""Время отчёта по динамике: цикл Python по сырым транзакциям против build_trend (NumPy по агрегатам).
+
+Запуск: python benchmarks/bench_trends.py [--rows 500000] [--years 5] [--repeat 10]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select
+from sqlite_profile import ENGINE_PROFILES, create_db_engine
+from models import Base, User, Category, CategoryType, Transaction
+from rollups import rebuild_rollups
+from trends import build_trend, trend_period
+
+
+def seed(engine, rows, years, users=10):
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'id': i, 'telegram_id': i} for i in range(1, users + 1)])
+        conn.execute(insert(Category), [
+            {'id': (u - 1) * 20 + c, 'user_id': u, 'name': f"категория{c}",
+             'type': CategoryType.income if c <= 3 else CategoryType.expense}
+            for u in range(1, users + 1) for c in range(1, 21)
+        ])
+        minutes = years * 365 * 24 * 60
+        start = datetime.now() - timedelta(minutes=minutes)
+        for offset in range(0, rows, 20000):
+            chunk = []
+            for _ in range(min(20000, rows - offset)):
+                user_id = random.randint(1, users)
+                chunk.append({
+                    'user_id': user_id,
+                    'category_id': (user_id - 1) * 20 + random.randint(1, 20),
+                    'amount': random.randint(1000, 500000),
+                    'date': start + timedelta(minutes=random.randint(0, minutes)),
+                })
+            conn.execute(insert(Transaction), chunk)
+        rebuild_rollups(conn)
+
+
+def python_trend(conn, user_id, granularity, start, end):
+    """Наивный вариант: сырые строки и разбиение по периодам в цикле Python"""
+    rows = conn.execute(
+        select(Transaction.date, Category.name, Transaction.amount).join(
+            Category, Category.id == Transaction.category_id
+        ).where(
+            Transaction.user_id == user_id, Category.type == CategoryType.expense,
+            Transaction.date >= datetime.combine(start, datetime.min.time()),
+            Transaction.date < datetime.combine(end, datetime.min.time())
+        )
+    )
+    matrix = {}
+    for date, name, amount in rows:
+        day = date.date()
+        if granularity == 'week':
+            bucket = day - timedelta(days=day.weekday())
+        elif granularity == 'month':
+            bucket = day.replace(day=1)
+        else:
+            bucket = day
+        key = (name, bucket)
+        matrix[key] = matrix.get(key, 0) + amount
+    return matrix
+
+
+def timed(repeat, fn, *args):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000, help='транзакций у 10 пользователей')
+    parser.add_argument('--years', type=int, default=5, help='глубина истории')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    today = datetime.now().date()
+    spans = {'day': args.years * 365, 'week': args.years * 52, 'month': args.years * 12}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(os.path.join(tmp, 'trends.db'), ENGINE_PROFILES['performance'])
+        Base.metadata.create_all(engine)
+        seed(engine, args.rows, args.years)
+
+        with engine.connect() as conn:
+            for granularity, span in spans.items():
+                start, end = trend_period(granularity, today, span)
+                legacy = timed(args.repeat, python_trend, conn, 1, granularity, start, end)
+                current = timed(args.repeat, build_trend, conn, 1, CategoryType.expense, granularity, start, end)
+                print(f"{granularity:6} периодов: {span:5}  было: {legacy:8.2f} мс  стало: {current:8.2f} мс  "
+                      f"ускорение: {legacy / current:6.1f}x")
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
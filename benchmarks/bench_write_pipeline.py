@@ -0,0 +1,98 @@
+# benchmarks/bench_write_pipeline.py
+"""Сравнение скорости записи: коммит на каждое сообщение против групповой записи.
+
+Запуск: python benchmarks/bench_write_pipeline.py [--threads 32] [--messages 200]
+База создаётся во временном каталоге, рабочая finance_bot.db не затрагивается.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base, User, Category, CategoryType
+from services import save_transaction
+from write_pipeline import TransactionWriter
+
+
+def make_database(path, users):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with closing(factory()) as session:
+        for i in range(users):
+            user = User(telegram_id=i + 1)
+            session.add(user)
+            session.flush()
+            session.add(Category(user_id=user.id, name='еда', type=CategoryType.expense))
+        session.commit()
+    return engine, factory
+
+
+def run_threads(threads, messages, send):
+    def worker(index):
+        for _ in range(messages):
+            send({
+                'user_id': index + 1,
+                'category_id': index + 1,
+                'amount': 10000,
+                'date': datetime.now(),
+            })
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return threads * messages / (time.perf_counter() - started)
+
+
+def bench_per_message(factory, threads, messages):
+    def send(row):
+        with closing(factory()) as session:
+            save_transaction(session, row)
+
+    return run_threads(threads, messages, send)
+
+
+def bench_pipeline(factory, threads, messages, batch_size, latency_ms):
+    writer = TransactionWriter(factory, max_batch=batch_size, max_latency=latency_ms / 1000)
+    try:
+        # Каждый поток ждёт подтверждения своей записи, как обработчик сообщения
+        rate = run_threads(threads, messages, lambda row: writer.submit(row).result())
+        return rate, writer.rows / max(writer.batches, 1)
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32, help='одновременных пользователей')
+    parser.add_argument('--messages', type=int, default=200, help='сообщений на пользователя')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--latency-ms', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _, factory = make_database(os.path.join(tmp, 'per_message.db'), args.threads)
+        per_message = bench_per_message(factory, args.threads, args.messages)
+
+        _, factory = make_database(os.path.join(tmp, 'pipeline.db'), args.threads)
+        pipeline, avg_batch = bench_pipeline(factory, args.threads, args.messages,
+                                             args.batch_size, args.latency_ms)
+
+    print(f"Коммит на сообщение: {per_message:10.1f} сообщений/с")
+    print(f"Групповая запись:    {pipeline:10.1f} сообщений/с (в среднем {avg_batch:.1f} строк на коммит)")
+    print(f"Ускорение:           {pipeline / per_message:10.2f}x")
+
+
+if __name__ == '__main__':
+    main()
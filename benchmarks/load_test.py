@@ -0,0 +1,281 @@
+# benchmarks/load_test.py
+"""Нагрузочный тест обработчиков main.py с поддельным Telegram Bot API.
+
+Создаёт во временном каталоге settings.ini и базу с историями разного размера,
+подменяет HTTP-запросы к Bot API (apihelper.CUSTOM_REQUEST_SENDER) записью
+ответов и прогоняет через bot.process_new_updates сценарии тысяч пользователей:
+добавление категории, транзакции, отчёт за месяц. Выводит p50/p95/p99
+задержки обработчиков, сообщений в секунду и число SQL-запросов на сообщение,
+а результаты сохраняет в JSON для сравнения версий. Запросы потока групповой
+записи (--pipeline) выполняются вне обработчика и в счётчик на сообщение не входят.
+
+Запуск: python benchmarks/load_test.py [--users 1000] [--threads 8] [--output load.json]
+        python benchmarks/load_test.py --compare load_old.json --output load_new.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EXPENSE_CATEGORIES = ['продукты', 'кафе', 'транспорт', 'дом', 'связь']
+INCOME_CATEGORIES = ['зарплата', 'подработка']
+# Размер истории пользователя (транзакций) и доля таких пользователей
+HISTORY_PROFILES = [(20, 0.70), (500, 0.25), (5000, 0.05)]
+TELEGRAM_ID_BASE = 10_000_000
+
+
+class FakeTelegramApi:
+    """Подмена Bot API: запоминает вызванные методы и отвечает правдоподобным Message"""
+
+    class Response:
+        status_code = 200
+        reason = 'OK'
+
+        def __init__(self, payload):
+            self.text = json.dumps(payload)
+
+        def json(self):
+            return json.loads(self.text)
+
+    def __init__(self):
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._message_id = 0
+
+    def __call__(self, method, url, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        params = kwargs.get('params') or {}
+        with self._lock:
+            self.calls[api_method] = self.calls.get(api_method, 0) + 1
+            self._message_id += 1
+            message_id = self._message_id
+        chat_id = int(params.get('chat_id', 0))
+        return self.Response({'ok': True, 'result': {
+            'message_id': message_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')
+        }})
+
+
+def write_settings(directory, pipeline):
+    with open(os.path.join(directory, 'settings.ini'), 'w', encoding='utf-8') as f:
+        f.write("[TOKEN]\ntoken = 123456:LOADTEST\n\n"
+                "[BOT]\nthreads = 2\n\n"
+                f"[PIPELINE]\nenabled = {'yes' if pipeline else 'no'}\n\n"
+                "[DATABASE]\npath = loadtest.db\nprofile = performance\n\n"
+                "[STATE]\nbackend = memory\n")
+
+
+def seed(engine, users):
+    """Пользователи с категориями и историей транзакций за три года"""
+    from sqlalchemy import insert
+    from models import User, Category, CategoryType, Transaction
+    from rollups import rebuild_rollups
+
+    categories_per_user = len(EXPENSE_CATEGORIES) + len(INCOME_CATEGORIES)
+    sizes = random.choices([size for size, _ in HISTORY_PROFILES],
+                           weights=[weight for _, weight in HISTORY_PROFILES], k=users)
+    start = datetime.now() - timedelta(days=3 * 365)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {'id': u, 'telegram_id': TELEGRAM_ID_BASE + u, 'username': f"user{u}"} for u in range(1, users + 1)
+        ])
+        conn.execute(insert(Category), [
+            {'id': (u - 1) * categories_per_user + c + 1, 'user_id': u, 'name': name,
+             'type': CategoryType.expense if c < len(EXPENSE_CATEGORIES) else CategoryType.income}
+            for u in range(1, users + 1)
+            for c, name in enumerate(EXPENSE_CATEGORIES + INCOME_CATEGORIES)
+        ])
+        chunk = []
+        for u, size in enumerate(sizes, start=1):
+            for _ in range(size):
+                chunk.append({
+                    'user_id': u,
+                    'category_id': (u - 1) * categories_per_user + random.randint(1, categories_per_user),
+                    'amount': random.randint(1000, 500000),
+                    'date': start + timedelta(minutes=random.randint(0, 3 * 365 * 24 * 60)),
+                })
+                if len(chunk) >= 20000:
+                    conn.execute(insert(Transaction), chunk)
+                    chunk = []
+        if chunk:
+            conn.execute(insert(Transaction), chunk)
+        rebuild_rollups(conn)
+    return sum(sizes)
+
+
+def scenario(user_index, transactions):
+    """Сообщения одного пользователя: (вид, текст) в порядке отправки"""
+    messages = [('add_category', '/add_category'),
+                ('save_new_category', f"трата категория{user_index}")]
+    for _ in range(transactions):
+        name = random.choice(EXPENSE_CATEGORIES + [f"категория{user_index}"])
+        messages.append(('transaction', f"трата {random.randint(10, 5000)},{random.randint(0, 99):02d} {name}"))
+    messages.append(('report', '/report'))
+    messages.append(('generate_report', 'Текущий месяц'))
+    return messages
+
+
+def make_update(update_id, telegram_id, text):
+    from telebot.types import Update
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': telegram_id, 'type': 'private'},
+            'from': {'id': telegram_id, 'is_bot': False, 'first_name': 'Load'},
+        }
+    })
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+def summarize(latencies, queries):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0,
+        'queries_per_message': round(sum(queries) / len(queries), 2) if queries else 0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    from sqlalchemy import event
+    from telebot import apihelper
+
+    fake_api = FakeTelegramApi()
+    apihelper.CUSTOM_REQUEST_SENDER = fake_api
+
+    import db
+    import main
+    main.create_app()
+    # Обработчики выполняются в вызывающем потоке, как в режиме webhook
+    main.bot.threaded = False
+    seeded = seed(db.get_engine(), args.users)
+
+    # Запросы считаются по потоку: обработчик выполняется целиком в потоке воркера
+    counter = threading.local()
+
+    @event.listens_for(db.get_engine(), 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter.queries = getattr(counter, 'queries', 0) + 1
+
+    results = {}
+    lock = threading.Lock()
+
+    def simulate(user_index):
+        telegram_id = TELEGRAM_ID_BASE + user_index
+        for n, (kind, text) in enumerate(scenario(user_index, args.transactions)):
+            update = make_update(user_index * 1000 + n, telegram_id, text)
+            counter.queries = 0
+            started = time.perf_counter()
+            main.bot.process_new_updates([update])
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies, queries = results.setdefault(kind, ([], []))
+                latencies.append(elapsed)
+                queries.append(counter.queries)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(simulate, range(1, args.users + 1)))
+    if main.transaction_writer:
+        main.transaction_writer.close()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [value for latencies, _ in results.values() for value in latencies]
+    all_queries = [value for _, queries in results.values() for value in queries]
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'users': args.users,
+            'threads': args.threads,
+            'transactions_per_user': args.transactions,
+            'pipeline': args.pipeline,
+            'seeded_transactions': seeded,
+        },
+        'messages_per_second': round(len(all_latencies) / elapsed, 1),
+        'total': summarize(all_latencies, all_queries),
+        'by_handler': {kind: summarize(*values) for kind, values in sorted(results.items())},
+        'api_calls': fake_api.calls,
+    }
+
+
+def print_report(result, baseline=None):
+    baseline = baseline or {}
+    line = f"Сообщений/с: {result['messages_per_second']}"
+    if baseline:
+        line += f" (было {baseline['messages_per_second']})"
+    print(line)
+
+    rows = [('всего', result['total'], baseline.get('total'))] + [
+        (kind, stats, baseline.get('by_handler', {}).get(kind)) for kind, stats in result['by_handler'].items()
+    ]
+    for title, stats, base in rows:
+        line = (f"{title:18} n={stats['count']:6}  p50 {stats['p50_ms']:8.2f} мс  p95 {stats['p95_ms']:8.2f} мс  "
+                f"p99 {stats['p99_ms']:8.2f} мс  запросов/сообщ. {stats['queries_per_message']:5.2f}")
+        if base and base.get('p95_ms'):
+            line += f"  p95 {(stats['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100:+.0f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000, help='симулируемых пользователей')
+    parser.add_argument('--transactions', type=int, default=10, help='транзакций на пользователя')
+    parser.add_argument('--threads', type=int, default=8, help='параллельных обработчиков')
+    parser.add_argument('--pipeline', action='store_true', help='включить групповую запись [PIPELINE]')
+    parser.add_argument('--output', help='куда сохранить результаты в JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    # create_app читает settings.ini и открывает базу относительно текущего каталога
+    with tempfile.TemporaryDirectory() as tmp:
+        write_settings(tmp, args.pipeline)
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            result = run(args)
+        finally:
+            os.chdir(cwd)
+
+    print_report(result, baseline)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+# cache.py
+from collections import OrderedDict
+import threading
+import time
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограничением размера и временем жизни записей"""
+
+    def __init__(self, maxsize=10000, ttl=None, name='cache', on_evict=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict  # вызывается с ключом вытесненной или истёкшей записи
+        self._data = OrderedDict()  # ключ -> (истекает_в, значение)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                if self.on_evict:
+                    self.on_evict(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted, _ = self._data.popitem(last=False)
+                self.evictions += 1
+                if self.on_evict:
+                    self.on_evict(evicted)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ReportCache:
+    """Готовые тексты отчётов по ключу (user_id, начало, конец периода).
+
+    Запись транзакции сбрасывает только отчёты пользователя, в период которых
+    она попадает; остальные продолжают отдаваться из памяти. Записи других
+    процессов сюда не доходят, поэтому отчёты живут не дольше ttl.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None, name='reports'):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl, name=name, on_evict=self._forget)
+        self._keys = {}  # user_id -> множество ключей в кэше
+        self._generations = {}  # user_id -> счётчик записей
+        # Всегда берётся раньше блокировки LRUCache, поэтому порядок блокировок один
+        self._lock = threading.RLock()
+
+    @property
+    def ttl(self):
+        return self._cache.ttl
+
+    @ttl.setter
+    def ttl(self, seconds):
+        self._cache.ttl = seconds
+
+    def generation(self, user_id):
+        """Снимок счётчика записей пользователя; передаётся в set после расчёта отчёта"""
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def get(self, user_id, start, end):
+        # Истёкшая запись удаляется с вызовом _forget, поэтому блокировка берётся до LRUCache
+        with self._lock:
+            return self._cache.get((user_id, start, end))
+
+    def set(self, user_id, start, end, text, generation):
+        """Кладёт отчёт, если с момента снимка generation у пользователя не было записей"""
+        key = (user_id, start, end)
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            self._keys.setdefault(user_id, set()).add(key)
+            self._cache.set(key, text)
+
+    def invalidate(self, user_id, moment=None):
+        """Сбрасывает отчёты пользователя, содержащие moment (или все, если moment не задан)"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            keys = self._keys.get(user_id, set())
+            affected = [
+                key for key in keys
+                if moment is None or ((key[1] is None or key[1] <= moment) and (key[2] is None or moment < key[2]))
+            ]
+            for key in affected:
+                self._forget(key)
+                self._cache.invalidate(key)
+
+    def _forget(self, key):
+        with self._lock:
+            keys = self._keys.get(key[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys[key[0]]
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class CategoryCache:
+    """Категории пользователей: (название, тип) -> id.
+
+    Категории пользователя загружаются одним запросом при первом обращении
+    и дальше обновляются при записи. Объём ограничен общим числом категорий,
+    при превышении вытесняются давно неактивные пользователи.
+    """
+
+    def __init__(self, max_entries=200000, name='categories'):
+        self.name = name
+        self.max_entries = max_entries
+        self._users = OrderedDict()  # user_id -> {(название, тип): id}
+        self._entries = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get_map(self, user_id, loader):
+        """Словарь категорий пользователя; loader(user_id) вызывается только при промахе"""
+        with self._lock:
+            categories = self._users.get(user_id)
+            if categories is not None:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return categories
+            self.misses += 1
+
+        categories = dict(loader(user_id))
+        with self._lock:
+            self.loads += 1
+            previous = self._users.pop(user_id, None)
+            if previous is not None:
+                self._entries -= len(previous)
+            self._users[user_id] = categories
+            self._entries += len(categories)
+            self._evict()
+        return categories
+
+    def add(self, user_id, name, category_type, category_id):
+        """Запись новой категории; если пользователь не загружен, она подтянется при загрузке"""
+        with self._lock:
+            categories = self._users.get(user_id)
+            if categories is not None and (name, category_type) not in categories:
+                categories[(name, category_type)] = category_id
+                self._entries += 1
+                self._evict()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            categories = self._users.pop(user_id, None)
+            if categories is not None:
+                self._entries -= len(categories)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._entries = 0
+
+    def _evict(self):
+        # Самого свежего пользователя не вытесняем, даже если он один превышает лимит
+        while self._entries > self.max_entries and len(self._users) > 1:
+            _, categories = self._users.popitem(last=False)
+            self._entries -= len(categories)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'users': len(self._users),
+            'size': self._entries,
+            'maxsize': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
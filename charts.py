@@ -0,0 +1,169 @@
+# charts.py
+"""Графики отчётов в PNG: круговая диаграмма расходов и столбцы доходов/расходов.
+
+Отрисовка matplotlib занимает сотни миллисекунд процессора, поэтому идёт в
+пуле процессов ChartRenderer, а не в потоке обработчика или цикле событий.
+Функции render_* получают только простые данные и возвращают байты PNG,
+чтобы их можно было передать в другой процесс. Готовую картинку отправляет
+отдельный небольшой пул потоков: колбэки future выполняются в служебном
+потоке пула процессов, и медленная загрузка в Telegram задержала бы выдачу
+всех остальных результатов.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import io
+import logging
+import multiprocessing
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Сколько категорий показывать на круговой диаграмме; остальные — в «Прочее»
+PIE_MAX_SLICES = 8
+CHART_DPI = 100
+
+
+class ChartBusyError(RuntimeError):
+    """Все слоты отрисовки заняты"""
+
+
+def _figure(width, height):
+    # Figure без pyplot: нет глобального состояния, backend Agg выбирается явно
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=(width, height), dpi=CHART_DPI)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _png(figure):
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def render_pie(title, labels, values):
+    """Круговая диаграмма; values — суммы в копейках по убыванию"""
+    if len(values) > PIE_MAX_SLICES:
+        labels = list(labels[:PIE_MAX_SLICES - 1]) + ['прочее']
+        values = list(values[:PIE_MAX_SLICES - 1]) + [sum(values[PIE_MAX_SLICES - 1:])]
+    figure = _figure(6, 6)
+    axes = figure.subplots()
+    axes.pie(values, labels=labels, autopct='%1.0f%%', startangle=90, counterclock=False)
+    axes.set_title(title)
+    axes.axis('equal')
+    return _png(figure)
+
+
+def render_bars(title, labels, income, expense):
+    """Столбцы доходов и расходов по периодам; суммы в копейках"""
+    figure = _figure(max(6, len(labels) * 0.35), 4)
+    axes = figure.subplots()
+    positions = range(len(labels))
+    width = 0.4
+    axes.bar([p - width / 2 for p in positions], [value / 100 for value in income], width,
+             label='Доходы', color='#4caf50')
+    axes.bar([p + width / 2 for p in positions], [value / 100 for value in expense], width,
+             label='Расходы', color='#f44336')
+    axes.set_xticks(list(positions))
+    axes.set_xticklabels(labels, rotation=45, ha='right', fontsize=8)
+    axes.set_ylabel('₽')
+    axes.set_title(title)
+    axes.legend()
+    axes.grid(axis='y', alpha=0.3)
+    return _png(figure)
+
+
+class ChartRenderer:
+    """Пул процессов для отрисовки с ограничением числа одновременных задач.
+
+    При занятых слотах submit сразу бросает ChartBusyError, чтобы очередь
+    отрисовок не росла без предела при всплеске запросов. Если передан
+    deliver, слот занят до конца отправки, так что max_concurrent ограничивает
+    и очередь загрузок.
+    """
+
+    def __init__(self, workers=2, max_concurrent=4, delivery_threads=2):
+        self.workers = workers
+        self.delivery_threads = delivery_threads
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._executor = None
+        self._delivery = None
+        self._lock = threading.Lock()
+        self.rendered = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: fork процесса с потоками бота может унаследовать захваченные блокировки
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _get_delivery(self):
+        with self._lock:
+            if self._delivery is None:
+                self._delivery = ThreadPoolExecutor(max_workers=self.delivery_threads,
+                                                    thread_name_prefix='chart-delivery')
+            return self._delivery
+
+    def submit(self, fn, *args, deliver=None):
+        """Future с байтами PNG; fn — функция уровня модуля (render_pie, render_bars).
+
+        deliver(future) вызывается по готовности в потоке доставки, а не в
+        служебном потоке пула процессов.
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise ChartBusyError("Слишком много графиков рисуется одновременно")
+        try:
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                # Воркер упал (например, его убил OOM): пул пересоздаётся один раз
+                self.close(wait=False)
+                future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done if deliver is None else lambda done: self._hand_off(deliver, done))
+        return future
+
+    def _hand_off(self, deliver, future):
+        try:
+            self._get_delivery().submit(self._deliver, deliver, future)
+        except RuntimeError:
+            # Пул доставки уже остановлен (close при выключении бота)
+            self._done(future)
+
+    def _deliver(self, deliver, future):
+        try:
+            deliver(future)
+        except Exception as e:
+            logger.error(f"Не удалось отправить график: {str(e)}")
+        finally:
+            self._done(future)
+
+    def _done(self, future):
+        self._slots.release()
+        if not future.cancelled() and future.exception() is None:
+            self.rendered += 1
+
+    def close(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+            if self._delivery is not None:
+                self._delivery.shutdown(wait=wait)
+                self._delivery = None
+
+
+def create_chart_renderer(config):
+    """Пул из секции [CHARTS]: workers, max_concurrent, delivery_threads"""
+    return ChartRenderer(
+        workers=config.getint('CHARTS', 'workers', fallback=2),
+        max_concurrent=config.getint('CHARTS', 'max_concurrent', fallback=4),
+        delivery_threads=config.getint('CHARTS', 'delivery_threads', fallback=2)
+    )
@@ -1,15 +1,77 @@
-from sqlalchemy import create_engine
+"""Подключение к базе.
+
+Импорт модуля не открывает базу и не выполняет DDL: движок создаётся при
+первом get_engine(), а схема проверяется один раз при старте бота через
+setup_database() (см. create_app в main.py и async_main.py).
+"""
 from sqlalchemy.orm import sessionmaker
-from models import Base
+from migrations import ensure_schema
+from sqlite_profile import load_database_settings, create_db_engine, apply_pragmas
+import threading
+
+# Фабрика сессий; движок привязывается в get_engine()
+SessionLocal = sessionmaker()
+
+_settings = None
+_engine = None
+_engine_lock = threading.Lock()
+_async_engine = None
+_async_session_factory = None
+
+
+def get_engine(config_path='settings.ini'):
+    """Синхронный движок из секции [DATABASE]; config_path учитывается только при первом вызове"""
+    global _settings, _engine
+    with _engine_lock:
+        if _engine is None:
+            _settings = load_database_settings(config_path)
+            _engine = create_db_engine(
+                _settings['path'],
+                _settings['pragmas'],
+                pool_size=_settings['pool_size'],
+                max_overflow=_settings['max_overflow'],
+                pool_timeout=_settings['pool_timeout'],
+            )
+            SessionLocal.configure(bind=_engine)
+        return _engine
+
+
+def setup_database(config_path='settings.ini'):
+    """Движок и проверка версии схемы; миграции выполняются, только если версия устарела"""
+    engine = get_engine(config_path)
+    ensure_schema(engine)
+    return engine
+
+
+def __getattr__(name):
+    # Совместимость с `from db import engine`: движок создаётся при первом обращении
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_async_session_factory():
+    """Фабрика асинхронных сессий (aiosqlite) для асинхронного режима бота.
+
+    Создаётся лениво, чтобы синхронный режим не требовал установленного aiosqlite.
+    """
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        _async_session_factory = async_sessionmaker(get_async_engine(), expire_on_commit=False)
+    return _async_session_factory
 
-# Исправленный путь к базе данных
-engine = create_engine("sqlite:///finance_bot.db", echo=False)
 
-# Создание таблиц при первом запуске
-Base.metadata.create_all(engine)
+def get_async_engine():
+    """Асинхронный движок (aiosqlite) с теми же прагмами, что и синхронный"""
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        get_engine()
+        _async_engine = create_async_engine(f"sqlite+aiosqlite:///{_settings['path']}", echo=False)
+        apply_pragmas(_async_engine.sync_engine, _settings['pragmas'])
+    return _async_engine
 
-# Создание фабрики сессий
-SessionLocal = sessionmaker(bind=engine)
 
 def get_session():
     """Генератор сессий для использования в контекстных менеджерах"""
@@ -17,4 +79,4 @@ def get_session():
     try:
         yield session
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
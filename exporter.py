@@ -0,0 +1,127 @@
+# exporter.py
+"""Потоковая выгрузка транзакций пользователя в CSV или JSON Lines.
+
+Строки читаются из базы пачками (yield_per) и сразу пишутся во временный
+файл, поэтому память не зависит от длины истории. CSV совместим с импортом
+(importer.py): выгрузку можно загрузить обратно без правок.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from models import Category, CategoryType, Transaction
+from money import format_money
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+# Строк в одной выборке из курсора
+YIELD_PER = 1000
+# Файлы больше этого размера сжимаются gzip автоматически
+GZIP_THRESHOLD = 5 * 1024 * 1024
+# Ограничение Bot API на отправку файлов ботом
+MAX_SEND_FILE_SIZE = 50 * 1024 * 1024
+
+EXPORT_FORMATS = {'csv': '.csv', 'json': '.jsonl'}
+CSV_HEADER = ('дата', 'тип', 'категория', 'сумма')
+TYPE_NAMES = {CategoryType.expense: 'трата', CategoryType.income: 'доход'}
+
+
+@dataclass
+class ExportResult:
+    path: str
+    filename: str
+    count: int
+    compressed: bool
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+
+def iter_export_rows(session, user_id, start=None, end=None):
+    """Транзакции пользователя (дата, тип, категория, сумма) по возрастанию даты, пачками из курсора"""
+    query = select(Transaction.date, Category.type, Category.name, Transaction.amount).join(
+        Category, Category.id == Transaction.category_id
+    ).where(Transaction.user_id == user_id)
+    if start and end:
+        query = query.where(Transaction.date >= start, Transaction.date < end)
+    query = query.order_by(Transaction.date, Transaction.id).execution_options(yield_per=YIELD_PER)
+    return session.execute(query)
+
+
+def write_csv(rows, stream):
+    writer = csv.writer(stream, delimiter=';')
+    writer.writerow(CSV_HEADER)
+    count = 0
+    for date, category_type, name, amount in rows:
+        writer.writerow((date.strftime('%Y-%m-%d %H:%M:%S'), TYPE_NAMES[category_type], name,
+                         format_money(amount)))
+        count += 1
+    return count
+
+
+def write_jsonl(rows, stream):
+    count = 0
+    for date, category_type, name, amount in rows:
+        stream.write(json.dumps({
+            'date': date.isoformat(sep=' ', timespec='seconds'),
+            'type': category_type.value,
+            'category': name,
+            # Копейки / 100 печатаются точно: repr float даёт кратчайшую запись
+            'amount': amount / 100,
+        }, ensure_ascii=False))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+WRITERS = {'csv': write_csv, 'json': write_jsonl}
+
+
+def _gzip_file(path):
+    """Сжимает готовый файл потоково и удаляет исходный"""
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+    return path + '.gz'
+
+
+def export_filename(start, end, fmt):
+    if start and end:
+        period = f"{start:%Y-%m-%d}_{end - timedelta(days=1):%Y-%m-%d}"
+    else:
+        period = 'all'
+    return f"transactions_{period}{EXPORT_FORMATS[fmt]}"
+
+
+def export_transactions(session, user_id, start=None, end=None, fmt='csv', compress=False):
+    """Пишет выгрузку во временный файл; удалить его после отправки должен вызывающий"""
+    if fmt not in WRITERS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    if start and end:
+        start = datetime.combine(start, datetime.min.time())
+        end = datetime.combine(end, datetime.min.time())
+
+    filename = export_filename(start, end, fmt)
+    fd, path = tempfile.mkstemp(suffix=EXPORT_FORMATS[fmt])
+    os.close(fd)
+    try:
+        rows = iter_export_rows(session, user_id, start, end)
+        # newline='' — csv сам пишет разделители строк
+        opener = gzip.open if compress else open
+        with opener(path, 'wt', encoding='utf-8', newline='') as stream:
+            count = WRITERS[fmt](rows, stream)
+
+        if not compress and os.path.getsize(path) > GZIP_THRESHOLD:
+            path = _gzip_file(path)
+            compress = True
+    except Exception:
+        os.remove(path)
+        raise
+
+    if compress:
+        filename += '.gz'
+    return ExportResult(path=path, filename=filename, count=count, compressed=compress)
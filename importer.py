@@ -0,0 +1,232 @@
+# importer.py
+"""Потоковый импорт транзакций из CSV и банковских выписок.
+
+Файл читается построчно, строки обрабатываются пачками: категории пачки
+сопоставляются одним словарём пользователя, транзакции вставляются одним
+executemany и фиксируются коммитом вместе с дневными агрегатами. Память
+ограничена размером пачки независимо от длины файла.
+"""
+from contextlib import closing
+from dataclasses import dataclass, field
+from datetime import datetime
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Category, CategoryType, Transaction
+from money import Money
+from rollups import add_to_rollups
+import services
+import csv
+import io
+import requests
+
+CHUNK_SIZE = 5000
+# Сколько ошибок по строкам хранить для отчёта пользователю
+MAX_REPORTED_ERRORS = 20
+
+# Названия колонок в разных выгрузках -> поле транзакции
+HEADER_ALIASES = {
+    'date': 'date', 'дата': 'date', 'дата операции': 'date', 'дата платежа': 'date',
+    'amount': 'amount', 'сумма': 'amount', 'сумма операции': 'amount', 'сумма платежа': 'amount',
+    'category': 'category', 'категория': 'category',
+    'type': 'type', 'тип': 'type',
+}
+TYPE_ALIASES = {
+    'трата': CategoryType.expense, 'расход': CategoryType.expense, 'expense': CategoryType.expense,
+    'доход': CategoryType.income, 'поступление': CategoryType.income, 'income': CategoryType.income,
+}
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d.%m.%Y', '%d.%m.%Y %H:%M:%S',
+                '%d.%m.%Y %H:%M', '%d/%m/%Y')
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    failed: int = 0
+    created_categories: list = field(default_factory=list)
+    errors: list = field(default_factory=list)  # (номер строки, причина), не больше MAX_REPORTED_ERRORS
+
+    def add_error(self, line_number, reason):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, reason))
+
+
+def parse_amount(text):
+    """Сумма в копейках из вида '300', '-1 200,50' или '1200.75'"""
+    try:
+        return Money.parse(text)
+    except ValueError as e:
+        raise RowError(str(e))
+
+
+class DateParser:
+    """Разбор даты с запоминанием последнего подошедшего формата"""
+
+    def __init__(self):
+        self._format = DATE_FORMATS[0]
+
+    def __call__(self, text):
+        text = text.strip()
+        for date_format in (self._format,) + DATE_FORMATS:
+            try:
+                value = datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+            self._format = date_format
+            return value
+        raise RowError(f"неверная дата '{text}'")
+
+
+def open_text_stream(binary):
+    """Текстовый поток поверх бинарного; кодировка угадывается по началу файла (UTF-8 или CP1251)"""
+    buffered = io.BufferedReader(binary) if not isinstance(binary, io.BufferedReader) else binary
+    head = buffered.peek(4096)
+    try:
+        head.decode('utf-8')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError as e:
+        # Ошибка только в обрезанном на границе буфера последнем символе — всё ещё UTF-8
+        encoding = 'utf-8-sig' if e.start >= len(head) - 3 else 'cp1251'
+    return io.TextIOWrapper(buffered, encoding=encoding, newline='')
+
+
+def iter_records(text_stream):
+    """Строки файла как (номер строки, {поле: значение}) без загрузки файла целиком"""
+    first_line = text_stream.readline()
+    delimiter = max((';', ',', '\t'), key=first_line.count)
+    header = next(csv.reader([first_line], delimiter=delimiter), [])
+    fields = [HEADER_ALIASES.get(name.strip().lower()) for name in header]
+    missing = {'date', 'amount', 'category'} - set(fields)
+    if missing:
+        raise RowError(f"в заголовке нет колонок: {', '.join(sorted(missing))}")
+
+    reader = csv.reader(text_stream, delimiter=delimiter)
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        # line_num считает строки файла с учётом заголовка и переносов внутри кавычек
+        yield reader.line_num + 1, {name: value for name, value in zip(fields, values) if name}
+
+
+def parse_record(record, parse_date):
+    """(дата, тип, категория, сумма) из строки файла; без колонки типа он берётся из знака суммы"""
+    amount = parse_amount(record.get('amount', ''))
+    type_text = record.get('type', '').strip().lower()
+    if type_text:
+        if type_text not in TYPE_ALIASES:
+            raise RowError(f"неизвестный тип '{type_text}'")
+        category_type = TYPE_ALIASES[type_text]
+    else:
+        category_type = CategoryType.expense if amount < 0 else CategoryType.income
+
+    name = record.get('category', '').strip().lower()
+    if not name:
+        raise RowError("пустая категория")
+    if amount == 0:
+        raise RowError("нулевая сумма")
+    return parse_date(record['date']), category_type, name, Money(abs(amount))
+
+
+def _create_categories(session, user_id, keys):
+    """Создаёт недостающие категории одним INSERT и возвращает их id"""
+    session.execute(
+        sqlite_insert(Category).values([
+            {'user_id': user_id, 'name': name, 'type': category_type} for name, category_type in keys
+        ]).on_conflict_do_nothing()
+    )
+    names = {name for name, _ in keys}
+    rows = session.execute(
+        select(Category.name, Category.type, Category.id).where(
+            Category.user_id == user_id, Category.name.in_(names)
+        )
+    )
+    return {(name, category_type): category_id for name, category_type, category_id in rows
+            if (name, category_type) in keys}
+
+
+def _flush_chunk(session, user_id, chunk, create_missing, result):
+    categories = services.category_map(session, user_id)
+
+    missing = {(name, category_type) for _, _, category_type, name, _ in chunk} - categories.keys()
+    if missing:
+        # Недостающие категории мог создать другой процесс
+        found = services.find_categories(session, user_id, missing)
+        categories = {**categories, **found}
+        missing -= found.keys()
+    if missing and create_missing:
+        created = _create_categories(session, user_id, missing)
+        for (name, category_type), category_id in created.items():
+            services.category_cache.add(user_id, name, category_type, category_id)
+        categories = {**categories, **created}
+        result.created_categories.extend(sorted(name for name, _ in created))
+
+    rows = []
+    for line_number, date, category_type, name, amount in chunk:
+        category_id = categories.get((name, category_type))
+        if category_id is None:
+            result.add_error(line_number, f"категория '{name}' не найдена")
+            continue
+        rows.append({'user_id': user_id, 'category_id': category_id, 'amount': amount, 'date': date})
+
+    if rows:
+        session.execute(insert(Transaction), rows)
+        add_to_rollups(session, [(row['user_id'], row['category_id'], row['date'], row['amount']) for row in rows])
+    session.commit()
+    services.report_cache.invalidate(user_id)
+    result.imported += len(rows)
+
+
+def import_transactions(session, user_id, text_stream, create_missing=False, progress=None,
+                        chunk_size=CHUNK_SIZE):
+    """Импортирует транзакции из CSV-потока; progress(обработано_строк) вызывается после каждой пачки"""
+    result = ImportResult()
+    parse_date = DateParser()
+    chunk = []
+    processed = 0
+
+    try:
+        for line_number, record in iter_records(text_stream):
+            processed += 1
+            try:
+                chunk.append((line_number, *parse_record(record, parse_date)))
+            except RowError as e:
+                result.add_error(line_number, str(e))
+
+            if len(chunk) >= chunk_size:
+                _flush_chunk(session, user_id, chunk, create_missing, result)
+                chunk = []
+                if progress:
+                    progress(processed)
+    except (RowError, csv.Error) as e:
+        result.add_error(0, str(e))
+
+    if chunk:
+        _flush_chunk(session, user_id, chunk, create_missing, result)
+    return result
+
+
+def import_from_url(session_factory, url, user_id, create_missing=False, progress=None):
+    """Скачивает файл потоком (без чтения в память целиком) и импортирует его"""
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with closing(session_factory()) as session:
+            return import_transactions(session, user_id, open_text_stream(response.raw),
+                                       create_missing=create_missing, progress=progress)
+
+
+def format_import_result(result):
+    lines = [f"📥 Импорт завершён: добавлено {result.imported}, с ошибками {result.failed}"]
+    if result.created_categories:
+        lines.append(f"📁 Созданы категории: {', '.join(result.created_categories)}")
+    if result.errors:
+        lines.append("\n⚠️ Ошибки:")
+        for line_number, reason in result.errors:
+            lines.append(f"  строка {line_number}: {reason}" if line_number else f"  {reason}")
+        if result.failed > len(result.errors):
+            lines.append(f"  … и ещё {result.failed - len(result.errors)}")
+    return "\n".join(lines)
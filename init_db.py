@@ -1,8 +1,37 @@
 # init_db.py
-from db import engine
+import sys
+from db import get_engine, SessionLocal
+from migrations import ensure_schema, set_schema_version, upgrade_schema
 from models import Base
+from rollups import check_rollups, rebuild_rollups
+from contextlib import closing
 
 if __name__ == '__main__':
-    Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
-    print("База данных успешно пересоздана!")
\ No newline at end of file
+    engine = get_engine()
+    if '--migrate' in sys.argv:
+        # Обновление существующей базы без удаления данных, независимо от записанной версии
+        upgrade_schema(engine)
+        print("База данных успешно обновлена!")
+    elif '--check-rollups' in sys.argv:
+        # Сверка дневных агрегатов с сырыми транзакциями, с --repair пересобирает их
+        with closing(SessionLocal()) as session:
+            mismatched = check_rollups(session)
+            print(f"Расхождений в агрегатах: {len(mismatched)}")
+            for user_id, day, category_id in mismatched[:20]:
+                print(f"  пользователь {user_id}, день {day}, категория {category_id}")
+            if mismatched and '--repair' in sys.argv:
+                rebuild_rollups(session)
+                session.commit()
+                print("Агрегаты пересобраны из транзакций")
+    elif '--reset' in sys.argv:
+        # Удаляет все данные
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            set_schema_version(conn)
+        print("База данных успешно пересоздана!")
+    else:
+        if ensure_schema(engine):
+            print("База данных создана или обновлена!")
+        else:
+            print("Схема базы актуальна")
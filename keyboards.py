@@ -0,0 +1,86 @@
+# keyboards.py
+from telebot.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from datetime import date
+
+HELP_TEXT = (
+    "💡 Справка по боту\n\n"
+    "💸 Добавить трату:\n"
+    "трата <сумма> <категория>\n"
+    "Пример: трата 300 продукты\n\n"
+    "💰 Добавить доход:\n"
+    "доход <сумма> <категория>\n"
+    "Пример: доход 50000 зарплата\n\n"
+    "📊 Показать отчёт: нажми кнопку 'Отчёт' или отправь /report\n"
+    "📈 Динамика расходов: /trend неделя (или день, месяц; добавь доход для доходов)\n"
+    "📁 Добавить категорию: нажми кнопку 'Добавить категорию' или отправь /add_category\n"
+    "💼 Бюджеты на месяц: /budget, задать лимит: /budget кафе 10000\n"
+    "🔁 Регулярные операции: /recurring трата 30000 аренда 5 (каждое 5-е число)\n"
+    "🗓 Сводка за неделю по понедельникам: /weekly\n"
+    "📥 Импорт из CSV или банковской выписки: /import\n"
+    "📤 Выгрузка транзакций: /export (csv или json, добавь gz для сжатия)\n\n"
+    "Используй кнопки ниже для быстрого доступа 👇"
+)
+
+REGISTERED_TEXT = (
+    "✅ Регистрация прошла успешно! Теперь ты можешь добавлять категории и транзакции.\n\n"
+    "💡 Для справки используй /help"
+)
+
+IMPORT_TEXT = (
+    "📥 Пришли CSV-файл документом. Нужны колонки дата, сумма и категория, "
+    "колонка тип (трата/доход) необязательна — без неё отрицательные суммы считаются тратами.\n\n"
+    "Чтобы недостающие категории создались автоматически, добавь к файлу подпись: создать"
+)
+
+# Ограничение Bot API на скачивание файлов ботом
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+
+ADD_CATEGORY_TEXT = "Напиши новую категорию в формате:\n\nтип название\n\nПримеры:\nтрата аптека\nдоход фриланс"
+
+
+# Создание клавиатуры
+def create_keyboard():
+    markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    markup.add(
+        KeyboardButton('Добавить трату'),
+        KeyboardButton('Добавить доход'),
+        KeyboardButton('Отчёт'),
+        KeyboardButton('Добавить категорию'),
+        KeyboardButton('Помощь')
+    )
+    return markup
+
+
+# Клавиатура для выбора типа периода
+def create_period_keyboard():
+    markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    markup.add(
+        KeyboardButton('Произвольный период'),
+        KeyboardButton('Текущий день'),
+        KeyboardButton('Текущая неделя'),
+        KeyboardButton('Текущий месяц'),
+        KeyboardButton('Текущий год'),
+        KeyboardButton('Все время'),
+        KeyboardButton('Назад')
+    )
+    return markup
+
+
+# Кнопки графиков под отчётом: callback_data 'chart:<вид>:<начало>:<конец>', '-' — без границы
+CHART_CALLBACK_PREFIX = 'chart:'
+
+
+def create_chart_keyboard(start_date, end_date):
+    period = f"{start_date.isoformat() if start_date else '-'}:{end_date.isoformat() if end_date else '-'}"
+    markup = InlineKeyboardMarkup()
+    markup.add(
+        InlineKeyboardButton('🥧 Расходы по категориям', callback_data=f"{CHART_CALLBACK_PREFIX}pie:{period}"),
+        InlineKeyboardButton('📊 Доходы и расходы', callback_data=f"{CHART_CALLBACK_PREFIX}bars:{period}")
+    )
+    return markup
+
+
+def parse_chart_callback(data):
+    """(вид, начало, конец) из callback_data кнопки графика"""
+    kind, start, end = data[len(CHART_CALLBACK_PREFIX):].split(':')
+    return kind, date.fromisoformat(start) if start != '-' else None, date.fromisoformat(end) if end != '-' else None
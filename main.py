@@ -1,13 +1,26 @@
 import telebot
-from sqlalchemy import func
-from telebot.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from telebot.types import Message, CallbackQuery
 import configparser
-from models import User, Category, CategoryType, Transaction
-from db import SessionLocal
+from db import SessionLocal, setup_database
+from write_pipeline import TransactionWriter
+from state_store import create_state_store
+from charts import ChartBusyError, create_chart_renderer
+from metrics import configure_metrics, instrumented
+from reports import NO_DATA_TEXT
+from keyboards import (create_keyboard, create_period_keyboard, HELP_TEXT, REGISTERED_TEXT, ADD_CATEGORY_TEXT,
+                       IMPORT_TEXT, MAX_IMPORT_FILE_SIZE, CHART_CALLBACK_PREFIX, create_chart_keyboard,
+                       parse_chart_callback)
+import exporter
+import importer
+import recurring
+import services
+from services import DATE_FORMAT
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 import logging
+import os
+import time
 from datetime import datetime, timedelta
-from calendar import monthrange
 
 # Настройка логирования
 logging.basicConfig(
@@ -16,61 +29,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-config = configparser.ConfigParser()
-config.read('settings.ini')
-token = config["TOKEN"]['token']
-bot = telebot.TeleBot(token)
-
-# Глобальные переменные для управления состоянием отчета
-user_report_state = {}
-DATE_FORMAT = "%Y-%m-%d"
-
-
-# Создание клавиатуры
-def create_keyboard():
-    markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    markup.add(
-        KeyboardButton('Добавить трату'),
-        KeyboardButton('Добавить доход'),
-        KeyboardButton('Отчёт'),
-        KeyboardButton('Добавить категорию'),
-        KeyboardButton('Помощь')
-    )
-    return markup
+# Заполняются в create_app(): импорт модуля не читает настройки и не открывает базу
+config = None
+bot = None
+transaction_writer = None
+report_states = None
+chart_renderer = None
+scheduler = None
+import_executor = None
 
 
 def get_user(session, message):
-    telegram_id = message.from_user.id
-    user = session.query(User).filter_by(telegram_id=telegram_id).first()
-    if not user:
+    """Внутренний id пользователя; при попадании в кэш база не запрашивается"""
+    user_id = services.find_user_id(session, message.from_user.id)
+    if not user_id:
         bot.reply_to(message, "⚠️ Сначала нужно зарегистрироваться командой /start", reply_markup=create_keyboard())
         return None
-    return user
+    return user_id
 
 
-@bot.message_handler(commands=['start'])
+@instrumented
 def handle_start(message: Message):
     try:
         with closing(SessionLocal()) as session:
-            telegram_id = message.from_user.id
-            user = session.query(User).filter_by(telegram_id=telegram_id).first()
-            if not user:
-                user = User(
-                    telegram_id=telegram_id,
-                    username=message.from_user.username,
-                    first_name=message.from_user.first_name,
-                    last_name=message.from_user.last_name
-                )
-                session.add(user)
-                session.commit()
-                logger.info(f"Создан новый пользователь: {telegram_id}")
-                help_text = (
-                    "✅ Регистрация прошла успешно! Теперь ты можешь добавлять категории и транзакции.\n\n"
-                    "💡 Для справки используй /help"
-                )
-                bot.reply_to(message, help_text, reply_markup=create_keyboard())
+            if services.register_user(session, message.from_user):
+                bot.reply_to(message, REGISTERED_TEXT, reply_markup=create_keyboard())
             else:
-                logger.info(f"Пользователь уже существует: {telegram_id}")
                 show_help(message)
     except Exception as e:
         logger.error(f"Ошибка в /start: {str(e)}")
@@ -79,86 +63,53 @@ def handle_start(message: Message):
 
 
 def show_help(message: Message):
-    help_text = (
-        "💡 Справка по боту\n\n"
-        "💸 Добавить трату:\n"
-        "трата <сумма> <категория>\n"
-        "Пример: трата 300 продукты\n\n"
-        "💰 Добавить доход:\n"
-        "доход <сумма> <категория>\n"
-        "Пример: доход 50000 зарплата\n\n"
-        "📊 Показать отчёт: нажми кнопку 'Отчёт' или отправь /report\n"
-        "📁 Добавить категорию: нажми кнопку 'Добавить категорию' или отправь /add_category\n\n"
-        "Используй кнопки ниже для быстрого доступа 👇"
-    )
-    bot.reply_to(message, help_text, reply_markup=create_keyboard())
+    bot.reply_to(message, HELP_TEXT, reply_markup=create_keyboard())
 
 
-@bot.message_handler(commands=['help'])
-@bot.message_handler(func=lambda m: m.text and m.text.strip().lower() == 'помощь')
+@instrumented
 def handle_help(message: Message):
     show_help(message)
 
 
-@bot.message_handler(commands=['add_category'])
-@bot.message_handler(func=lambda m: m.text and m.text.strip().lower() == 'добавить категорию')
+@instrumented
 def handle_add_category(message: Message):
-    bot.reply_to(message,
-                 "Напиши новую категорию в формате:\n\nтип название\n\nПримеры:\nтрата аптека\nдоход фриланс")
-    bot.register_next_step_handler(message, save_new_category)
+    # Шаг хранится вместе с шагами мастера отчёта: общий для процессов при [STATE] backend = sqlite
+    report_states.set(message.from_user.id, {'step': 'add_category'})
+    bot.reply_to(message, ADD_CATEGORY_TEXT)
 
 
-def save_new_category(message: Message):
-    try:
-        with closing(SessionLocal()) as session:
-            user = get_user(session, message)
-            if not user:
-                return
+def is_adding_category(message: Message):
+    """Ответ на /add_category ('трата аптека') иначе забрал бы обработчик транзакций"""
+    if not (message.text and len(message.text.split()) == 2 and
+            message.text.split()[0].lower() in services.TYPE_MAP):
+        return False
+    state = report_states.get(message.from_user.id)
+    return bool(state) and state.get('step') == 'add_category'
 
-            parts = message.text.strip().lower().split()
-            if len(parts) != 2:
-                bot.reply_to(message, "❌ Неверный формат. Попробуй ещё раз.", reply_markup=create_keyboard())
-                return
-
-            type_text, category_name = parts
-            type_map = {"трата": CategoryType.expense, "доход": CategoryType.income}
 
-            if type_text not in type_map:
-                bot.reply_to(message, "❌ Тип должен быть 'трата' или 'доход'.", reply_markup=create_keyboard())
+@instrumented
+def save_new_category(message: Message, state: dict = None):
+    report_states.delete(message.from_user.id)
+    try:
+        with closing(SessionLocal()) as session:
+            user_id = get_user(session, message)
+            if not user_id:
                 return
 
-            # Проверка существования категории
-            exists = session.query(Category).filter_by(
-                user_id=user.id,
-                name=category_name,
-                type=type_map[type_text]
-            ).first()
-
-            if exists:
-                bot.reply_to(message, f"ℹ️ Категория '{category_name}' уже существует.", reply_markup=create_keyboard())
-            else:
-                category = Category(
-                    user_id=user.id,
-                    name=category_name,
-                    type=type_map[type_text]
-                )
-                session.add(category)
-                session.commit()
-                logger.info(f"Добавлена категория: {category_name} для пользователя {user.id}")
-                bot.reply_to(message, f"✅ Категория '{category_name}' добавлена!", reply_markup=create_keyboard())
+            reply = services.add_category(session, user_id, message.text)
+            bot.reply_to(message, reply, reply_markup=create_keyboard())
     except Exception as e:
         logger.error(f"Ошибка при добавлении категории: {str(e)}")
         bot.reply_to(message, "❌ Произошла ошибка при добавлении категории. Попробуй снова.",
                      reply_markup=create_keyboard())
 
 
-@bot.message_handler(func=lambda m: m.text and m.text.strip().lower() in ['добавить трату', 'добавить доход'] or
-                                    (len(m.text.split()) > 0 and m.text.split()[0].lower() in ['трата', 'доход']))
+@instrumented
 def handle_transaction(message: Message):
     try:
         with closing(SessionLocal()) as session:
-            user = get_user(session, message)
-            if not user:
+            user_id = get_user(session, message)
+            if not user_id:
                 return
 
             # Если нажата кнопка, просим ввести данные
@@ -167,164 +118,201 @@ def handle_transaction(message: Message):
                 bot.reply_to(message, f"Введи данные в формате:\n{example}")
                 return
 
-            parts = message.text.strip().lower().split()
-            if len(parts) < 3:
-                bot.reply_to(message, "❌ Неверный формат. Пример: трата 300 кафе",
-                             reply_markup=create_keyboard())
-                return
+            if transaction_writer:
+                row, reply = services.prepare_transaction(session, user_id, message.text)
+                if row:
+                    # Подтверждаем только после коммита пачки
+                    month_total = transaction_writer.submit(row).result()
+                    reply = services.with_budget_alert(session, row, month_total, reply)
+            else:
+                reply = services.add_transaction(session, user_id, message.text)
+            bot.reply_to(message, reply, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении транзакции: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка при сохранении транзакции. Попробуй снова.",
+                     reply_markup=create_keyboard())
 
-            type_text = parts[0]
-            try:
-                amount = float(parts[1])
-                category_name = parts[2]
-            except ValueError:
-                bot.reply_to(message, "❌ Неверный формат суммы. Пример: трата 300 кафе",
-                             reply_markup=create_keyboard())
-                return
 
-            type_map = {"трата": CategoryType.expense, "доход": CategoryType.income}
+@instrumented
+def handle_import(message: Message):
+    bot.reply_to(message, IMPORT_TEXT, reply_markup=create_keyboard())
 
-            if type_text not in type_map:
-                bot.reply_to(message, "❌ Первое слово должно быть 'трата' или 'доход'. Пример: трата 300 кафе",
-                             reply_markup=create_keyboard())
-                return
 
-            # Найти категорию
-            category = session.query(Category).filter_by(
-                user_id=user.id,
-                name=category_name,
-                type=type_map[type_text]
-            ).first()
+@instrumented
+def handle_import_document(message: Message):
+    try:
+        with closing(SessionLocal()) as session:
+            user_id = get_user(session, message)
+        if not user_id:
+            return
 
-            if not category:
-                bot.reply_to(message, f"❌ Категория '{category_name}' не найдена. Добавь её через /add_category",
-                             reply_markup=create_keyboard())
-                return
+        if message.document.file_size and message.document.file_size > MAX_IMPORT_FILE_SIZE:
+            bot.reply_to(message, "❌ Файл больше 20 МБ, раздели его на части.", reply_markup=create_keyboard())
+            return
 
-            # Добавить транзакцию
-            transaction = Transaction(
-                user_id=user.id,
-                category_id=category.id,
-                amount=amount,
-                date=datetime.now()
-            )
-            session.add(transaction)
-            session.commit()
-            logger.info(f"Добавлена транзакция: {amount}₽ по категории {category_name} для пользователя {user.id}")
-
-            emoji = "💸" if type_text == "трата" else "💰"
-            bot.reply_to(message,
-                         f"{emoji} {'Доход' if type_text == 'доход' else 'Трата'} {amount}₽ по категории '{category_name}' сохранена.",
-                         reply_markup=create_keyboard())
+        status = bot.reply_to(message, "⏳ Импорт начат…")
+        # Скачивание и импорт идут в отдельном пуле и не занимают поток обработчиков
+        import_executor.submit(run_import, message, status, user_id)
     except Exception as e:
-        logger.error(f"Ошибка при добавлении транзакции: {str(e)}")
-        bot.reply_to(message, "❌ Произошла ошибка при сохранении транзакции. Попробуй снова.",
-                     reply_markup=create_keyboard())
+        logger.error(f"Ошибка при импорте: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка при импорте. Попробуй снова.", reply_markup=create_keyboard())
+
+
+@instrumented
+def run_import(message: Message, status: Message, user_id):
+    """Импорт файла из сообщения; выполняется в import_executor"""
+    try:
+        last_update = [time.monotonic()]
+
+        def progress(processed):
+            # Не чаще раза в 3 секунды, чтобы не упереться в лимиты Telegram
+            if time.monotonic() - last_update[0] >= 3:
+                last_update[0] = time.monotonic()
+                bot.edit_message_text(f"⏳ Обработано строк: {processed}", status.chat.id, status.message_id)
+
+        create_missing = 'создать' in (message.caption or '').lower()
+        result = importer.import_from_url(SessionLocal, bot.get_file_url(message.document.file_id),
+                                          user_id, create_missing=create_missing, progress=progress)
+        logger.info(f"Импорт для пользователя {user_id}: добавлено {result.imported}, ошибок {result.failed}")
+        bot.reply_to(message, importer.format_import_result(result), reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при импорте: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка при импорте. Попробуй снова.", reply_markup=create_keyboard())
 
 
-@bot.message_handler(commands=['report'])
-@bot.message_handler(func=lambda m: m.text and m.text.strip().lower() == 'отчёт')
+@instrumented
 def handle_report(message: Message):
     try:
         # Сохраняем состояние пользователя
-        user_report_state[message.from_user.id] = {
+        report_states.set(message.from_user.id, {
             'step': 'select_period_type',
             'start_date': None,
             'end_date': None
-        }
-
-        # Создаем клавиатуру для выбора типа периода
-        markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-        markup.add(
-            KeyboardButton('Произвольный период'),
-            KeyboardButton('Текущий день'),
-            KeyboardButton('Текущая неделя'),
-            KeyboardButton('Текущий месяц'),
-            KeyboardButton('Текущий год'),
-            KeyboardButton('Все время'),
-            KeyboardButton('Назад')
-        )
+        })
 
-        bot.reply_to(message, "📆 Выбери тип периода для отчёта:", reply_markup=markup)
+        bot.reply_to(message, "📆 Выбери тип периода для отчёта:", reply_markup=create_period_keyboard())
     except Exception as e:
         logger.error(f"Ошибка при формировании отчёта: {str(e)}")
         bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
 
 
-@bot.message_handler(func=lambda m: user_report_state.get(m.from_user.id, {}).get('step') == 'select_period_type')
-def handle_period_type_selection(message: Message):
+@instrumented
+def handle_trend(message: Message):
     try:
-        user_id = message.from_user.id
-        period_type = message.text.strip().lower()
-        state = user_report_state.get(user_id, {})
+        with closing(SessionLocal()) as session:
+            user_id = get_user(session, message)
+            if user_id:
+                args = message.text.lower().split()[1:]
+                report = services.build_trend_report(session, user_id, args, datetime.now().date())
+                bot.reply_to(message, report, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при формировании динамики: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка при формировании отчёта. Попробуй позже.",
+                     reply_markup=create_keyboard())
 
-        if period_type == 'назад':
-            bot.reply_to(message, "Возвращаемся в главное меню", reply_markup=create_keyboard())
-            if user_id in user_report_state:
-                del user_report_state[user_id]
-            return
 
-        today = datetime.now().date()
+@instrumented
+def handle_budget(message: Message):
+    try:
+        with closing(SessionLocal()) as session:
+            user_id = get_user(session, message)
+            if user_id:
+                args = message.text.lower().split()[1:]
+                reply = services.handle_budget_command(session, user_id, args, datetime.now().date())
+                bot.reply_to(message, reply, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при работе с бюджетом: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
 
-        if period_type == 'текущий день':
-            state['start_date'] = today
-            state['end_date'] = today + timedelta(days=1)
-            state['step'] = 'generate_report'
-            generate_report(message, state)
 
-        elif period_type == 'текущая неделя':
-            # Начало недели (понедельник)
-            start_date = today - timedelta(days=today.weekday())
-            state['start_date'] = start_date
-            state['end_date'] = start_date + timedelta(days=7)
-            state['step'] = 'generate_report'
-            generate_report(message, state)
+@instrumented
+def handle_recurring(message: Message):
+    try:
+        with closing(SessionLocal()) as session:
+            user_id = get_user(session, message)
+            if user_id:
+                text = message.text.split(maxsplit=1)[1] if len(message.text.split()) > 1 else ''
+                reply, job = recurring.recurring_command(session, user_id, text, datetime.now())
+                if job and scheduler:
+                    scheduler.schedule(*job)
+                bot.reply_to(message, reply, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при работе с регулярными операциями: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
 
-        elif period_type == 'текущий месяц':
-            start_date = today.replace(day=1)
-            # Конец месяца
-            _, last_day = monthrange(today.year, today.month)
-            state['start_date'] = start_date
-            state['end_date'] = start_date + timedelta(days=last_day)
-            state['step'] = 'generate_report'
-            generate_report(message, state)
 
-        elif period_type == 'текущий год':
-            start_date = today.replace(month=1, day=1)
-            end_date = today.replace(month=12, day=31)
-            state['start_date'] = start_date
-            state['end_date'] = end_date
-            state['step'] = 'generate_report'
-            generate_report(message, state)
+@instrumented
+def handle_weekly(message: Message):
+    try:
+        with closing(SessionLocal()) as session:
+            user_id = get_user(session, message)
+            if user_id:
+                reply, job = recurring.weekly_command(session, user_id, datetime.now())
+                if job and scheduler:
+                    scheduler.schedule(*job)
+                bot.reply_to(message, reply, reply_markup=create_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при настройке сводки: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
 
-        elif period_type == 'все время':
-            state['start_date'] = None
-            state['end_date'] = None
-            state['step'] = 'generate_report'
-            generate_report(message, state)
 
-        elif period_type == 'произвольный период':
+@instrumented
+def handle_export(message: Message):
+    try:
+        args = message.text.lower().split()[1:]
+        fmt = 'json' if 'json' in args else 'csv'
+        report_states.set(message.from_user.id, {
+            'step': 'select_period_type',
+            'start_date': None,
+            'end_date': None,
+            'export': {'format': fmt, 'compress': 'gz' in args}
+        })
+
+        bot.reply_to(message, "📆 Выбери период для выгрузки:", reply_markup=create_period_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
+
+
+@instrumented
+def handle_period_type_selection(message: Message, state: dict):
+    try:
+        user_id = message.from_user.id
+        period_type = message.text.strip().lower()
+
+        if period_type == 'назад':
+            bot.reply_to(message, "Возвращаемся в главное меню", reply_markup=create_keyboard())
+            report_states.delete(user_id)
+            return
+
+        if period_type == 'произвольный период':
             state['step'] = 'select_start_date'
+            report_states.set(user_id, state)
             bot.reply_to(message, "📅 Введи начальную дату в формате ГГГГ-ММ-ДД (например, 2025-07-01):")
+            return
 
-        else:
+        bounds = services.period_bounds(period_type, datetime.now().date())
+        if bounds is None:
             bot.reply_to(message, "❌ Неизвестный тип периода. Попробуй еще раз.")
+            return
+
+        state['start_date'], state['end_date'] = bounds
+        state['step'] = 'generate_report'
+        finish_period_selection(message, state)
 
     except Exception as e:
         logger.error(f"Ошибка при выборе типа периода: {str(e)}")
         bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
 
 
-@bot.message_handler(func=lambda m: user_report_state.get(m.from_user.id, {}).get('step') == 'select_start_date')
-def handle_start_date_selection(message: Message):
+@instrumented
+def handle_start_date_selection(message: Message, state: dict):
     try:
-        user_id = message.from_user.id
-        state = user_report_state.get(user_id, {})
-
         try:
             start_date = datetime.strptime(message.text, DATE_FORMAT).date()
             state['start_date'] = start_date
             state['step'] = 'select_end_date'
+            report_states.set(message.from_user.id, state)
             bot.reply_to(message, "📅 Введи конечную дату в формате ГГГГ-ММ-ДД (например, 2025-07-15):")
         except ValueError:
             bot.reply_to(message, "❌ Неверный формат даты. Используй формат ГГГГ-ММ-ДД (например, 2025-07-15)")
@@ -334,17 +322,14 @@ def handle_start_date_selection(message: Message):
         bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
 
 
-@bot.message_handler(func=lambda m: user_report_state.get(m.from_user.id, {}).get('step') == 'select_end_date')
-def handle_end_date_selection(message: Message):
+@instrumented
+def handle_end_date_selection(message: Message, state: dict):
     try:
-        user_id = message.from_user.id
-        state = user_report_state.get(user_id, {})
-
         try:
             end_date = datetime.strptime(message.text, DATE_FORMAT).date()
             state['end_date'] = end_date + timedelta(days=1)  # Чтобы включить весь конечный день
             state['step'] = 'generate_report'
-            generate_report(message, state)
+            finish_period_selection(message, state)
         except ValueError:
             bot.reply_to(message, "❌ Неверный формат даты. Используй формат ГГГГ-ММ-ДД (например, 2025-07-15)")
 
@@ -353,118 +338,224 @@ def handle_end_date_selection(message: Message):
         bot.reply_to(message, "❌ Произошла ошибка. Попробуй позже.", reply_markup=create_keyboard())
 
 
+@instrumented
 def generate_report(message: Message, state: dict):
     try:
         with closing(SessionLocal()) as session:
-            user = get_user(session, message)
-            if not user:
-                if message.from_user.id in user_report_state:
-                    del user_report_state[message.from_user.id]
-                return
+            user_id = get_user(session, message)
+            if user_id:
+                report = services.build_report(session, user_id, state.get('start_date'), state.get('end_date'))
+                bot.reply_to(message, report, reply_markup=create_keyboard())
+                if report != NO_DATA_TEXT:
+                    bot.send_message(message.chat.id, "Показать графиком:",
+                                     reply_markup=create_chart_keyboard(state.get('start_date'),
+                                                                        state.get('end_date')))
 
-            start_date = state.get('start_date')
-            end_date = state.get('end_date')
-
-            # Запрос для сумм по категориям
-            query = session.query(
-                Category.name,
-                Category.type,
-                func.sum(Transaction.amount).label('total')
-            ).join(Transaction.category).filter(
-                Transaction.user_id == user.id
-            )
-
-            if start_date and end_date:
-                # Преобразуем в datetime для сравнения
-                start_datetime = datetime.combine(start_date, datetime.min.time())
-                end_datetime = datetime.combine(end_date, datetime.min.time())
-
-                query = query.filter(Transaction.date >= start_datetime, Transaction.date < end_datetime)
-                period_title = f"📊 Отчёт за период с {start_date.strftime('%d.%m.%Y')} по {(end_date - timedelta(days=1)).strftime('%d.%m.%Y')}"
-            else:
-                period_title = "📊 Отчёт за всё время"
+    except Exception as e:
+        logger.error(f"Ошибка при формировании отчёта: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка при формировании отчёта. Попробуй позже.",
+                     reply_markup=create_keyboard())
 
-            results = query.group_by(Category.name, Category.type).all()
+    # Очищаем состояние
+    report_states.delete(message.from_user.id)
 
-            if not results:
-                bot.reply_to(message, "📭 Нет данных за выбранный период", reply_markup=create_keyboard())
-                if message.from_user.id in user_report_state:
-                    del user_report_state[message.from_user.id]
-                return
 
-            # Собираем данные
-            income_total = 0
-            expense_total = 0
-            income_details = []
-            expense_details = []
-
-            for name, ctype, total in results:
-                if ctype == CategoryType.income:
-                    income_total += total
-                    income_details.append((name, total))
-                else:
-                    expense_total += total
-                    expense_details.append((name, total))
-
-            balance = income_total - expense_total
-
-            # Формируем отчёт
-            report = [period_title]
-
-            if income_details:
-                report.append("\n💰 Доходы:")
-                for name, amount in income_details:
-                    report.append(f"  - {name}: {amount:.2f}₽")
-                report.append(f"  Итого доходы: {income_total:.2f}₽")
-
-            if expense_details:
-                report.append("\n💸 Расходы:")
-                for name, amount in expense_details:
-                    report.append(f"  - {name}: {amount:.2f}₽")
-                report.append(f"  Итого расходы: {expense_total:.2f}₽")
-
-            report.append(f"\n📈 Баланс: {balance:.2f}₽")
-
-            # Добавляем общее количество транзакций за период
-            if start_date and end_date:
-                tx_count = session.query(Transaction).filter(
-                    Transaction.user_id == user.id,
-                    Transaction.date >= start_datetime,
-                    Transaction.date < end_datetime
-                ).count()
-            else:
-                tx_count = session.query(Transaction).filter_by(user_id=user.id).count()
+@instrumented
+def handle_chart(call: CallbackQuery):
+    try:
+        kind, start_date, end_date = parse_chart_callback(call.data)
+        with closing(SessionLocal()) as session:
+            user_id = services.find_user_id(session, call.from_user.id)
+            chart = services.prepare_chart(session, user_id, kind, start_date, end_date) if user_id else None
+        if chart is None:
+            bot.answer_callback_query(call.id, "📭 Нет данных для графика")
+            return
 
-            report.append(f"Всего транзакций: {tx_count}")
+        key, render, args = chart
+        # Та же картинка уже загружалась: отправляем по file_id без отрисовки и загрузки
+        file_id = services.chart_file_ids.get(key)
+        if file_id:
+            bot.send_photo(call.message.chat.id, file_id)
+        else:
+            # Поток обработчика не ждёт отрисовку: фото отправит поток доставки по готовности
+            chart_renderer.submit(render, *args, deliver=lambda done: send_chart(call, key, done))
+            return
+        bot.answer_callback_query(call.id)
+    except ChartBusyError:
+        bot.answer_callback_query(call.id, "⏳ Сейчас рисуется много графиков, попробуй через минуту")
+    except Exception as e:
+        logger.error(f"Ошибка при построении графика: {str(e)}")
+        bot.answer_callback_query(call.id, "❌ Не удалось построить график")
 
-            bot.reply_to(message, "\n".join(report), reply_markup=create_keyboard())
 
-            # Очищаем состояние
-            if message.from_user.id in user_report_state:
-                del user_report_state[message.from_user.id]
+@instrumented
+def send_chart(call: CallbackQuery, key, future):
+    """Отправляет готовую картинку; вызывается в потоке доставки ChartRenderer"""
+    try:
+        sent = bot.send_photo(call.message.chat.id, future.result())
+        services.chart_file_ids.set(key, sent.photo[-1].file_id)
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.error(f"Ошибка при построении графика: {str(e)}")
+        bot.answer_callback_query(call.id, "❌ Не удалось построить график")
+
+
+@instrumented
+def generate_export(message: Message, state: dict):
+    try:
+        with closing(SessionLocal()) as session:
+            user_id = get_user(session, message)
+            if user_id:
+                options = state['export']
+                result = exporter.export_transactions(session, user_id, state.get('start_date'),
+                                                      state.get('end_date'), options['format'], options['compress'])
+                try:
+                    send_export(message, result)
+                finally:
+                    os.remove(result.path)
 
     except Exception as e:
-        logger.error(f"Ошибка при формировании отчёта: {str(e)}")
-        bot.reply_to(message, "❌ Произошла ошибка при формировании отчёта. Попробуй позже.",
-                     reply_markup=create_keyboard())
-        if message.from_user.id in user_report_state:
-            del user_report_state[message.from_user.id]
+        logger.error(f"Ошибка при выгрузке: {str(e)}")
+        bot.reply_to(message, "❌ Произошла ошибка при выгрузке. Попробуй позже.", reply_markup=create_keyboard())
+
+    report_states.delete(message.from_user.id)
+
+
+def send_export(message: Message, result):
+    if not result.count:
+        bot.reply_to(message, NO_DATA_TEXT, reply_markup=create_keyboard())
+    elif result.size > exporter.MAX_SEND_FILE_SIZE:
+        bot.reply_to(message, "❌ Выгрузка больше 50 МБ, выбери период короче.", reply_markup=create_keyboard())
+    else:
+        with open(result.path, 'rb') as document:
+            bot.send_document(message.chat.id, document, visible_file_name=result.filename,
+                              caption=f"📤 Транзакций: {result.count}", reply_markup=create_keyboard())
+
+
+def finish_period_selection(message: Message, state: dict):
+    """Последний шаг мастера: отчёт или выгрузка за выбранный период"""
+    if state.get('export'):
+        generate_export(message, state)
+    else:
+        generate_report(message, state)
 
 
-@bot.message_handler(func=lambda m: True)
+# Шаги диалогов (мастер отчёта, новая категория): шаг из состояния -> обработчик
+REPORT_STEPS = {
+    'add_category': save_new_category,
+    'select_period_type': handle_period_type_selection,
+    'select_start_date': handle_start_date_selection,
+    'select_end_date': handle_end_date_selection,
+}
+
+
+@instrumented
 def handle_other_messages(message: Message):
-    """Обработчик для любых других сообщений"""
+    """Обработчик для любых других сообщений: шаги мастера отчёта и неизвестный ввод"""
     # Проверяем, есть ли текст в сообщении
     if not message.text:
         return
 
-    if message.text.startswith('/'):
+    # Одно обращение к хранилищу и выбор обработчика по шагу вместо проверки каждого шага
+    state = report_states.get(message.from_user.id)
+    step_handler = REPORT_STEPS.get(state.get('step')) if state else None
+    if step_handler:
+        step_handler(message, state)
+    elif message.text.startswith('/'):
         bot.reply_to(message, "❌ Неизвестная команда. Используй /help для списка команд.",
                      reply_markup=create_keyboard())
     else:
         bot.reply_to(message, "Я тебя не понимаю 😢\nИспользуй кнопки или команду /help", reply_markup=create_keyboard())
 
 
+def register_handlers(bot):
+    """Обработчики бота; проверяются по порядку регистрации, handle_other_messages — последним"""
+    bot.register_message_handler(handle_start, commands=['start'])
+    bot.register_message_handler(handle_help, commands=['help'])
+    bot.register_message_handler(handle_help, func=lambda m: m.text and m.text.strip().lower() == 'помощь')
+    bot.register_message_handler(handle_add_category, commands=['add_category'])
+    bot.register_message_handler(handle_add_category,
+                                 func=lambda m: m.text and m.text.strip().lower() == 'добавить категорию')
+    bot.register_message_handler(save_new_category, func=is_adding_category)
+    bot.register_message_handler(
+        handle_transaction,
+        func=lambda m: m.text and m.text.strip().lower() in ['добавить трату', 'добавить доход'] or
+                       (len(m.text.split()) > 0 and m.text.split()[0].lower() in ['трата', 'доход'])
+    )
+    bot.register_message_handler(handle_import, commands=['import'])
+    bot.register_message_handler(handle_import_document, content_types=['document'])
+    bot.register_message_handler(handle_report, commands=['report'])
+    bot.register_message_handler(handle_report, func=lambda m: m.text and m.text.strip().lower() == 'отчёт')
+    bot.register_message_handler(handle_trend, commands=['trend'])
+    bot.register_message_handler(handle_budget, commands=['budget'])
+    bot.register_message_handler(handle_recurring, commands=['recurring'])
+    bot.register_message_handler(handle_weekly, commands=['weekly'])
+    bot.register_message_handler(handle_export, commands=['export'])
+    bot.register_callback_query_handler(
+        handle_chart, func=lambda call: call.data and call.data.startswith(CHART_CALLBACK_PREFIX)
+    )
+    bot.register_message_handler(handle_other_messages, func=lambda m: True)
+
+
+def create_app(config_path='settings.ini'):
+    """Фабрика приложения: настройки, база с проверкой версии схемы, бот и обработчики"""
+    global config, bot, transaction_writer, report_states, chart_renderer, scheduler, import_executor
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    engine = setup_database(config_path)
+    bot = telebot.TeleBot(config["TOKEN"]['token'], num_threads=config.getint('BOT', 'threads', fallback=2))
+
+    # Групповая запись транзакций: [PIPELINE] enabled = yes, batch_size, max_latency_ms
+    transaction_writer = None
+    if config.getboolean('PIPELINE', 'enabled', fallback=False):
+        transaction_writer = TransactionWriter(
+            SessionLocal,
+            max_batch=config.getint('PIPELINE', 'batch_size', fallback=200),
+            max_latency=config.getint('PIPELINE', 'max_latency_ms', fallback=5) / 1000,
+            on_commit=services.transactions_committed
+        )
+
+    # Время жизни кэшей, которые не видят записей других процессов бота: [CACHE]
+    services.configure_caches(config)
+
+    # Состояние мастера отчёта: [STATE] backend = memory | sqlite
+    report_states = create_state_store(config, SessionLocal)
+
+    # Отрисовка графиков в пуле процессов: [CHARTS] workers, max_concurrent
+    chart_renderer = create_chart_renderer(config)
+
+    # Импорт файлов до 20 МБ: [IMPORT] threads; остальные импорты ждут в очереди
+    import_executor = ThreadPoolExecutor(max_workers=config.getint('IMPORT', 'threads', fallback=1),
+                                         thread_name_prefix='import')
+
+    # Время обработчиков, SQL на сообщение и вызовы Bot API: [METRICS]
+    configure_metrics(config, bot, engine, caches=services.cache_stats)
+
+    # Регулярные операции и сводки: [SCHEDULER]; поток запускается при старте бота, а не здесь
+    scheduler = None
+    if config.getboolean('SCHEDULER', 'enabled', fallback=True):
+        scheduler = recurring.create_scheduler(config, SessionLocal, bot.send_message)
+
+    register_handlers(bot)
+    return bot
+
+
 if __name__ == '__main__':
-    logger.info("Бот запущен. Ожидаю команды...")
-    bot.infinity_polling()
\ No newline at end of file
+    # Режим работы выбирается в settings.ini: [BOT] mode = sync | async | webhook
+    settings = configparser.ConfigParser()
+    settings.read('settings.ini')
+    mode = settings.get('BOT', 'mode', fallback='sync')
+    if mode == 'async':
+        import asyncio
+        import async_main
+        asyncio.run(async_main.main())
+    else:
+        create_app()
+        if scheduler:
+            scheduler.start()
+        if mode == 'webhook':
+            import webhook
+            webhook.run_webhook(bot, config)
+        else:
+            logger.info("Бот запущен. Ожидаю команды...")
+            bot.infinity_polling()
@@ -0,0 +1,331 @@
+# metrics.py
+"""Метрики горячего пути: время обработчиков, SQL на запрос и вызовы Bot API.
+
+Обработчики помечаются декоратором @instrumented. Самый внешний вызов
+открывает контекст запроса (contextvars, поэтому работает и в потоках, и в
+задачах asyncio). SQL-запросы движка, подключённого через instrument_engine,
+и вызовы Bot API после instrument_bot учитываются в этом контексте. Метрики
+отдаются в текстовом формате Prometheus на локальном порту (секция [METRICS])
+вместе с размерами и попаданиями кэшей.
+Медленные запросы можно писать в лог вместе с выполненным SQL.
+"""
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
+import inspect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+# Сколько SQL-запросов хранить в контексте для лога медленных запросов
+MAX_LOGGED_STATEMENTS = 50
+# Методы Bot API, которые вызывают обработчики
+API_METHODS = ('reply_to', 'send_message', 'send_photo', 'send_document', 'edit_message_text',
+               'answer_callback_query')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # метки -> [счётчики по корзинам..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+handler_duration = Histogram('bot_handler_duration_seconds', 'Время обработки сообщения', ['handler'])
+handler_errors = Counter('bot_handler_errors_total', 'Исключения, вышедшие из обработчика', ['handler'])
+request_sql_statements = Histogram('bot_request_sql_statements', 'SQL-запросов на одно сообщение',
+                                   ['handler'], buckets=COUNT_BUCKETS)
+request_sql_duration = Histogram('bot_request_sql_duration_seconds', 'Суммарное время SQL на одно сообщение',
+                                 ['handler'])
+sql_statements = Counter('bot_sql_statements_total', 'Все выполненные SQL-запросы')
+api_duration = Histogram('bot_telegram_api_duration_seconds', 'Время вызова Bot API', ['method'])
+slow_requests = Counter('bot_slow_requests_total', 'Сообщения дольше порога slow_request_ms', ['handler'])
+
+
+class CacheStats:
+    """Показатели кэшей из source() -> [cache.stats(), ...], снимаются при каждом запросе /metrics"""
+
+    # Поле stats() -> (метрика, тип, описание)
+    FIELDS = {
+        'size': ('bot_cache_entries', 'gauge', 'Записей в кэше'),
+        'maxsize': ('bot_cache_max_entries', 'gauge', 'Лимит записей кэша'),
+        'hits': ('bot_cache_hits_total', 'counter', 'Попадания в кэш'),
+        'misses': ('bot_cache_misses_total', 'counter', 'Промахи кэша'),
+        'evictions': ('bot_cache_evictions_total', 'counter', 'Записи, вытесненные по лимиту'),
+    }
+
+    def __init__(self, source=None):
+        self.source = source
+
+    def render(self):
+        if self.source is None:
+            return []
+        stats = self.source()
+        lines = []
+        for field, (name, kind, documentation) in self.FIELDS.items():
+            lines.extend((f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"))
+            lines.extend(f'{name}{{cache="{item["name"]}"}} {item[field]}' for item in stats)
+        return lines
+
+
+cache_stats = CacheStats()
+
+REGISTRY = [handler_duration, handler_errors, request_sql_statements, request_sql_duration, sql_statements,
+            api_duration, slow_requests, cache_stats]
+
+
+def render_metrics():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class RequestContext:
+    __slots__ = ('handler', 'started', 'sql_count', 'sql_time', 'statements')
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = []
+
+
+_current_request = ContextVar('current_request', default=None)
+# Внутри reply_to вызывается send_message: учитывается только внешний вызов
+_in_api_call = ContextVar('in_api_call', default=False)
+# Порог лога медленных запросов в секундах; None — лог выключен
+slow_request_threshold = None
+
+
+def _start(name):
+    """Открывает контекст запроса или уточняет имя обработчика во вложенном вызове"""
+    request = _current_request.get()
+    if request is not None:
+        # handle_other_messages -> handle_end_date_selection -> generate_report: метка — последний шаг
+        request.handler = name
+        return None
+    return _current_request.set(RequestContext(name))
+
+
+def _finish(token, failed):
+    request = _current_request.get()
+    _current_request.reset(token)
+    elapsed = time.perf_counter() - request.started
+    handler_duration.observe(elapsed, request.handler)
+    request_sql_statements.observe(request.sql_count, request.handler)
+    request_sql_duration.observe(request.sql_time, request.handler)
+    if failed:
+        handler_errors.inc(request.handler)
+    if slow_request_threshold is not None and elapsed >= slow_request_threshold:
+        slow_requests.inc(request.handler)
+        statements = '\n'.join(f"  {duration * 1000:7.2f} мс  {statement}"
+                               for statement, duration in request.statements)
+        logger.warning(f"Медленный запрос {request.handler}: {elapsed * 1000:.1f} мс, "
+                       f"SQL: {request.sql_count} за {request.sql_time * 1000:.1f} мс\n{statements}")
+
+
+def instrumented(fn):
+    """Декоратор обработчика (обычного или async): время, SQL и ошибки с меткой имени функции"""
+    name = fn.__name__
+
+    if inspect.iscoroutinefunction(fn):
+        @wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            token = _start(name)
+            if token is None:
+                return await fn(*args, **kwargs)
+            failed = True
+            try:
+                result = await fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _finish(token, failed)
+        return async_wrapper
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _start(name)
+        if token is None:
+            return fn(*args, **kwargs)
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _finish(token, failed)
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_started'].pop()
+    sql_statements.inc()
+    request = _current_request.get()
+    if request is not None:
+        request.sql_count += 1
+        request.sql_time += duration
+        if len(request.statements) < MAX_LOGGED_STATEMENTS:
+            request.statements.append((' '.join(statement.split()), duration))
+
+
+def _handle_error(context):
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine):
+    """Счётчики и время SQL-запросов движка (для AsyncEngine передаётся engine.sync_engine)"""
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def _timed_api_call(method_name, method):
+    if inspect.iscoroutinefunction(method):
+        @wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            if _in_api_call.get():
+                return await method(*args, **kwargs)
+            token = _in_api_call.set(True)
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                api_duration.observe(time.perf_counter() - started, method_name)
+                _in_api_call.reset(token)
+        return async_wrapper
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if _in_api_call.get():
+            return method(*args, **kwargs)
+        token = _in_api_call.set(True)
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            api_duration.observe(time.perf_counter() - started, method_name)
+            _in_api_call.reset(token)
+    return wrapper
+
+
+def instrument_bot(bot):
+    """Замер времени вызовов Bot API у экземпляра TeleBot или AsyncTeleBot"""
+    for method_name in API_METHODS:
+        setattr(bot, method_name, _timed_api_call(method_name, getattr(bot, method_name)))
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host='127.0.0.1', port=9100):
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+_metrics_server = None
+
+
+def configure_metrics(config, bot, *engines, caches=None):
+    """Подключает замеры к боту и движкам и запускает сервер из секции [METRICS] (один на процесс).
+
+    caches — функция, возвращающая stats() кэшей процесса (services.cache_stats).
+    """
+    global slow_request_threshold, _metrics_server
+    cache_stats.source = caches
+    for engine in engines:
+        instrument_engine(engine)
+    instrument_bot(bot)
+    slow_ms = config.getint('METRICS', 'slow_request_ms', fallback=0)
+    slow_request_threshold = slow_ms / 1000 if slow_ms > 0 else None
+    if _metrics_server is None and config.getboolean('METRICS', 'enabled', fallback=False):
+        _metrics_server = start_metrics_server(config.get('METRICS', 'host', fallback='127.0.0.1'),
+                                               config.getint('METRICS', 'port', fallback=9100))
+    return _metrics_server
@@ -0,0 +1,136 @@
+# migrations.py
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from models import Base, DailyRollup, Transaction
+from rollups import rebuild_monthly_spend, rebuild_rollups
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def dedupe_categories(conn):
+    """Схлопывает дубли категорий перед созданием уникального индекса"""
+    duplicates = conn.execute(text(
+        "SELECT c.id, keep.min_id FROM categories c "
+        "JOIN (SELECT user_id, type, name, MIN(id) AS min_id FROM categories "
+        "      GROUP BY user_id, type, name HAVING COUNT(*) > 1) keep "
+        "  ON c.user_id IS keep.user_id AND c.type = keep.type AND c.name = keep.name "
+        "WHERE c.id != keep.min_id"
+    )).all()
+
+    for duplicate_id, keep_id in duplicates:
+        conn.execute(text("UPDATE transactions SET category_id = :keep WHERE category_id = :dup"),
+                     {"keep": keep_id, "dup": duplicate_id})
+        conn.execute(text("DELETE FROM categories WHERE id = :dup"), {"dup": duplicate_id})
+
+    if duplicates:
+        logger.info(f"Объединено дублей категорий: {len(duplicates)}")
+
+
+def create_missing_indexes(conn):
+    """Создаёт индексы, объявленные в моделях, которых ещё нет в базе"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _column_type(conn, table, column):
+    for row in conn.execute(text(f"PRAGMA table_info({table})")):
+        if row.name == column:
+            return row.type.upper()
+
+
+def convert_amounts_to_kopecks(conn):
+    """Переводит суммы из рублей во float в целые копейки.
+
+    У колонки FLOAT в SQLite вещественное сродство: целые значения в ней снова
+    хранились бы как REAL, поэтому таблица транзакций пересоздаётся, а строки
+    переносятся одним INSERT ... SELECT. Дневные агрегаты строятся заново.
+    """
+    if _column_type(conn, 'transactions', 'amount') != 'INTEGER':
+        conn.execute(text("DROP INDEX IF EXISTS ix_transactions_user_date"))
+        conn.execute(text("ALTER TABLE transactions RENAME TO transactions_float"))
+        Transaction.__table__.create(conn)
+        moved = conn.execute(text(
+            "INSERT INTO transactions (id, user_id, category_id, amount, date) "
+            "SELECT id, user_id, category_id, CAST(ROUND(amount * 100) AS INTEGER), date "
+            "FROM transactions_float"
+        )).rowcount
+        conn.execute(text("DROP TABLE transactions_float"))
+        logger.info(f"Суммы переведены в копейки: {moved} транзакций")
+
+    if _column_type(conn, 'daily_rollups', 'total') != 'INTEGER':
+        DailyRollup.__table__.drop(conn)
+        DailyRollup.__table__.create(conn)
+        rebuild_rollups(conn)
+
+
+def backfill_rollups(conn):
+    """Заполняет дневные агрегаты для баз, созданных до их появления"""
+    has_rollups = conn.execute(text("SELECT 1 FROM daily_rollups LIMIT 1")).first()
+    has_transactions = conn.execute(text("SELECT 1 FROM transactions LIMIT 1")).first()
+    if has_transactions and not has_rollups:
+        rebuild_rollups(conn)
+        logger.info("Дневные агрегаты построены по существующим транзакциям")
+
+
+def backfill_monthly_spend(conn):
+    """Заполняет суммы месяцев для проверки бюджетов в базах, созданных до их появления"""
+    has_spend = conn.execute(text("SELECT 1 FROM monthly_spend LIMIT 1")).first()
+    has_transactions = conn.execute(text("SELECT 1 FROM transactions LIMIT 1")).first()
+    if has_transactions and not has_spend:
+        rebuild_monthly_spend(conn)
+        logger.info("Суммы месяцев построены по существующим транзакциям")
+
+
+# Шаги выполняются по порядку и должны быть идемпотентными
+MIGRATIONS = [
+    dedupe_categories,
+    create_missing_indexes,
+    convert_amounts_to_kopecks,
+    backfill_rollups,
+    backfill_monthly_spend,
+]
+
+
+# Увеличивается при добавлении шага в MIGRATIONS, таблицы или индекса в models.py
+SCHEMA_VERSION = 3
+
+
+def get_schema_version(conn):
+    """Версия схемы из базы; None для новой базы или базы до появления таблицы версий"""
+    try:
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    except OperationalError:
+        return None
+
+
+def set_schema_version(conn, version=SCHEMA_VERSION):
+    conn.execute(text("DELETE FROM schema_version"))
+    conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": version})
+
+
+def upgrade_schema(engine):
+    """Приводит существующую базу к текущей схеме без потери данных"""
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for step in MIGRATIONS:
+            step(conn)
+        set_schema_version(conn)
+
+
+def ensure_schema(engine):
+    """Проверка при старте: один запрос к schema_version, если база уже актуальна.
+
+    Иначе выполняет create_all и все шаги MIGRATIONS. Возвращает True, если
+    схема обновлялась.
+    """
+    with engine.connect() as conn:
+        version = get_schema_version(conn)
+    if version == SCHEMA_VERSION:
+        return False
+    if version is not None and version > SCHEMA_VERSION:
+        raise RuntimeError(f"Схема базы версии {version} новее поддерживаемой ({SCHEMA_VERSION}), обнови бота")
+    upgrade_schema(engine)
+    logger.info(f"Схема базы обновлена до версии {SCHEMA_VERSION}")
+    return True
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, Enum
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Date, DateTime, Enum, Index
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
+from money import MoneyType
 import enum
 
 Base = declarative_base()
@@ -31,13 +32,80 @@ class Category(Base):
     user = relationship("User", back_populates="categories")
     transactions = relationship("Transaction", back_populates="category")
 
+    __table_args__ = (
+        # Поиск категории по (пользователь, тип, название) и защита от дублей
+        Index('uq_categories_user_type_name', 'user_id', 'type', 'name', unique=True),
+    )
+
 class Transaction(Base):
     __tablename__ = 'transactions'
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     category_id = Column(Integer, ForeignKey('categories.id'), nullable=False)
-    amount = Column(Float, nullable=False)
+    amount = Column(MoneyType, nullable=False)  # копейки
     date = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="transactions")
-    category = relationship("Category", back_populates="transactions")
\ No newline at end of file
+    category = relationship("Category", back_populates="transactions")
+
+    __table_args__ = (
+        # Отчёты фильтруют по пользователю и диапазону дат
+        Index('ix_transactions_user_date', 'user_id', 'date'),
+    )
+
+
+class DailyRollup(Base):
+    """Сумма и количество транзакций пользователя по категории за день"""
+    __tablename__ = 'daily_rollups'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    category_id = Column(Integer, ForeignKey('categories.id'), primary_key=True)
+    total = Column(MoneyType, nullable=False, default=0)  # копейки
+    count = Column(Integer, nullable=False, default=0)
+
+
+class MonthlySpend(Base):
+    """Нарастающая сумма транзакций пользователя по категории за месяц (для проверки бюджетов)"""
+    __tablename__ = 'monthly_spend'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    category_id = Column(Integer, ForeignKey('categories.id'), primary_key=True)
+    month = Column(Date, primary_key=True)  # первое число месяца
+    total = Column(MoneyType, nullable=False, default=0)  # копейки
+
+
+class Budget(Base):
+    """Месячный лимит расходов по категории"""
+    __tablename__ = 'budgets'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    category_id = Column(Integer, ForeignKey('categories.id'), primary_key=True)
+    amount = Column(MoneyType, nullable=False)  # копейки
+
+class RecurringRule(Base):
+    """Регулярная транзакция: планировщик записывает её каждый месяц в день day_of_month"""
+    __tablename__ = 'recurring_rules'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    category_id = Column(Integer, ForeignKey('categories.id'), nullable=False)
+    amount = Column(MoneyType, nullable=False)  # копейки
+    day_of_month = Column(Integer, nullable=False)
+    next_run = Column(DateTime, nullable=False)
+
+
+class ScheduledReport(Base):
+    """Подписка пользователя на еженедельную сводку"""
+    __tablename__ = 'scheduled_reports'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    next_run = Column(DateTime, nullable=False)
+
+class ConversationState(Base):
+    """Состояние диалога пользователя (мастер отчёта и т.п.) для SqliteStateStore"""
+    __tablename__ = 'conversation_states'
+    telegram_id = Column(Integer, primary_key=True)
+    state = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class SchemaVersion(Base):
+    """Версия схемы базы: при совпадении с migrations.SCHEMA_VERSION миграции при старте пропускаются"""
+    __tablename__ = 'schema_version'
+    version = Column(Integer, primary_key=True)
@@ -0,0 +1,57 @@
+# money.py
+"""Денежные суммы в копейках.
+
+Суммы хранятся в базе целым числом копеек (колонки типа MoneyType), поэтому
+SUM в SQLite и сложение в Python точные, без ошибок округления float.
+"""
+from sqlalchemy import Integer
+from sqlalchemy.types import TypeDecorator
+import re
+
+# '300', '-300,50', '1 200.75', '1 200 000' (пробелы допустимы только между группами по три цифры)
+AMOUNT_PATTERN = r'[-+]?(?:\d{1,3}(?:[ \xa0]\d{3})+|\d+)(?:[.,]\d{1,2})?'
+_AMOUNT_RE = re.compile(AMOUNT_PATTERN)
+
+
+class Money(int):
+    """Сумма в копейках; str() даёт рубли с двумя знаками после точки"""
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, text):
+        """Сумма из ввода пользователя; ValueError, если это не сумма"""
+        text = text.strip()
+        if not _AMOUNT_RE.fullmatch(text):
+            raise ValueError(f"неверная сумма '{text}'")
+        sign = -1 if text.startswith('-') else 1
+        rubles, _, kopecks = text.lstrip('+-').replace('\xa0', '').replace(' ', '').replace(',', '.').partition('.')
+        return cls(sign * (int(rubles) * 100 + int(kopecks.ljust(2, '0'))))
+
+    def __str__(self):
+        return format_money(self)
+
+    def __repr__(self):
+        return f"Money('{format_money(self)}')"
+
+
+def format_money(kopecks):
+    """'1200.50' для 120050; принимает любое целое число копеек"""
+    rubles, rest = divmod(abs(kopecks), 100)
+    return f"{'-' if kopecks < 0 else ''}{rubles}.{rest:02d}"
+
+
+class MoneyType(TypeDecorator):
+    """Колонка INTEGER с копейками; значения читаются как Money"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        # float означает пропущенное преобразование в копейки — лучше упасть, чем записать рубли
+        if isinstance(value, float):
+            raise TypeError(f"Сумма должна быть в копейках (int или Money), получено {value!r}")
+        return int(value)
+
+    def process_result_value(self, value, dialect):
+        return Money(value) if value is not None else None
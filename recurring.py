@@ -0,0 +1,270 @@
+# recurring.py
+"""Регулярные транзакции и еженедельные сводки, выполняемые планировщиком.
+
+Срок следующего запуска хранится в базе (next_run), планировщик при старте
+загружает его в кучу. Наступившие задачи обрабатываются пачками: регулярные
+транзакции вставляются одним INSERT вместе с агрегатами, а сводки для всех
+пользователей пачки строятся одним сгруппированным запросом по daily_rollups.
+"""
+from calendar import monthrange
+from contextlib import closing
+from datetime import datetime, time, timedelta
+from sqlalchemy import delete, func, insert, select, update
+from models import Category, CategoryType, DailyRollup, RecurringRule, ScheduledReport, Transaction, User
+from money import AMOUNT_PATTERN, Money, format_money
+from rollups import add_to_rollups
+from scheduler import Outbox, Scheduler
+import logging
+import re
+import services
+
+logger = logging.getLogger(__name__)
+
+# Час, в который записываются регулярные транзакции и отправляются сводки
+RUN_HOUR = 9
+# Сводка за прошлую неделю приходит по понедельникам
+WEEKLY_REPORT_WEEKDAY = 0
+# Сколько пропущенных месяцев дописывать после простоя бота
+MAX_CATCH_UP = 12
+# 'трата 30 000 аренда 5'
+RECURRING_RE = re.compile(rf"(\S+)\s+({AMOUNT_PATTERN})\s+(\S+)\s+(\d{{1,2}})")
+RECURRING_HELP_TEXT = ("Регулярная операция записывается автоматически каждый месяц:\n"
+                       "/recurring <трата|доход> <сумма> <категория> <число месяца>\n"
+                       "Пример: /recurring трата 30000 аренда 5\nУдалить: /recurring удалить <номер>")
+
+
+def next_monthly_run(day, after):
+    """Ближайшее day-е число месяца в RUN_HOUR позже after (в коротких месяцах — последний день)"""
+    year, month = after.year, after.month
+    while True:
+        candidate = datetime(year, month, min(day, monthrange(year, month)[1]), RUN_HOUR)
+        if candidate > after:
+            return candidate
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def next_weekly_run(after):
+    """Ближайший понедельник в RUN_HOUR позже after"""
+    days = (WEEKLY_REPORT_WEEKDAY - after.weekday()) % 7
+    candidate = datetime.combine(after.date() + timedelta(days=days), time(RUN_HOUR))
+    return candidate if candidate > after else candidate + timedelta(days=7)
+
+
+def load_jobs(session):
+    """Задачи для кучи планировщика: (вид, ключ, срок)"""
+    jobs = [('recurring', rule_id, next_run)
+            for rule_id, next_run in session.execute(select(RecurringRule.id, RecurringRule.next_run))]
+    jobs.extend(('weekly', user_id, next_run)
+                for user_id, next_run in session.execute(select(ScheduledReport.user_id, ScheduledReport.next_run)))
+    return jobs
+
+
+def run_recurring_rules(session, rule_ids, now):
+    """Записывает наступившие регулярные транзакции пачкой.
+
+    Возвращает ([(id правила, следующий срок)], [(chat_id, уведомление)]).
+    Правила, перенесённые или удалённые после постановки в кучу, пропускаются.
+    """
+    rules = session.execute(
+        select(RecurringRule.id, RecurringRule.user_id, RecurringRule.category_id, RecurringRule.amount,
+               RecurringRule.day_of_month, RecurringRule.next_run, Category.name, Category.type, User.telegram_id)
+        .join(Category, Category.id == RecurringRule.category_id)
+        .join(User, User.id == RecurringRule.user_id)
+        .where(RecurringRule.id.in_(rule_ids), RecurringRule.next_run <= now)
+    ).all()
+    if not rules:
+        return [], []
+
+    rows = []
+    owners = []
+    updates = []
+    for rule in rules:
+        run = rule.next_run
+        for _ in range(MAX_CATCH_UP):
+            if run > now:
+                break
+            rows.append({'user_id': rule.user_id, 'category_id': rule.category_id, 'amount': rule.amount,
+                         'date': run})
+            owners.append(rule)
+            run = next_monthly_run(rule.day_of_month, run)
+        if run <= now:
+            run = next_monthly_run(rule.day_of_month, now)
+        updates.append({'id': rule.id, 'next_run': run})
+
+    session.execute(insert(Transaction), rows)
+    month_totals = add_to_rollups(session, [
+        (row['user_id'], row['category_id'], row['date'], row['amount']) for row in rows
+    ])
+    session.execute(update(RecurringRule), updates)
+    session.commit()
+    services.transactions_committed(rows)
+    logger.info(f"Записано регулярных транзакций: {len(rows)} по {len(rules)} правилам")
+
+    current_month = [row for row in rows if (row['date'].year, row['date'].month) == (now.year, now.month)]
+    services.preload_budget_limits(session, {row['user_id'] for row in current_month})
+    messages = []
+    for row, rule, month_total in zip(rows, owners, month_totals):
+        if rule.type == CategoryType.income:
+            text = f"🔁 Регулярный доход {format_money(row['amount'])}₽ по категории '{rule.name}' записан."
+        else:
+            text = f"🔁 Регулярная трата {format_money(row['amount'])}₽ по категории '{rule.name}' записана."
+        # Бюджет проверяется только для текущего месяца, а не для дописанных пропущенных
+        if (row['date'].year, row['date'].month) == (now.year, now.month):
+            text = services.with_budget_alert(session, row, month_total, text)
+        messages.append((rule.telegram_id, text))
+    return [(item['id'], item['next_run']) for item in updates], messages
+
+
+def format_weekly_summary(items, start, end):
+    """Текст сводки по строкам (категория, тип, сумма) за [start, end)"""
+    income = sum(total for _, category_type, total in items if category_type == CategoryType.income)
+    expenses = sorted(((name, total) for name, category_type, total in items
+                       if category_type == CategoryType.expense), key=lambda item: item[1], reverse=True)
+    lines = [f"🗓 Сводка за неделю {start.strftime('%d.%m')}–{(end - timedelta(days=1)).strftime('%d.%m')}:",
+             f"💰 Доходы: {format_money(income)}₽",
+             f"💸 Расходы: {format_money(sum(total for _, total in expenses))}₽"]
+    if expenses:
+        lines.append("Больше всего потрачено:")
+        lines.extend(f"  - {name}: {format_money(total)}₽" for name, total in expenses[:3])
+    return "\n".join(lines)
+
+
+def run_weekly_reports(session, user_ids, now):
+    """Сводки за прошедшую неделю для пачки пользователей одним сгруппированным запросом.
+
+    Возвращает ([(User.id, следующий срок)], [(chat_id, текст)]); пользователям
+    без транзакций за неделю сводка не отправляется.
+    """
+    due = session.execute(
+        select(ScheduledReport.user_id, User.telegram_id)
+        .join(User, User.id == ScheduledReport.user_id)
+        .where(ScheduledReport.user_id.in_(user_ids), ScheduledReport.next_run <= now)
+    ).all()
+    if not due:
+        return [], []
+
+    end = now.date() - timedelta(days=(now.weekday() - WEEKLY_REPORT_WEEKDAY) % 7)
+    start = end - timedelta(days=7)
+    rows = session.execute(
+        select(DailyRollup.user_id, Category.name, Category.type, func.sum(DailyRollup.total))
+        .join(Category, Category.id == DailyRollup.category_id)
+        .where(DailyRollup.user_id.in_([user_id for user_id, _ in due]),
+               DailyRollup.day >= start, DailyRollup.day < end)
+        .group_by(DailyRollup.user_id, DailyRollup.category_id)
+    )
+    by_user = {}
+    for user_id, name, category_type, total in rows:
+        by_user.setdefault(user_id, []).append((name, category_type, total))
+
+    next_run = next_weekly_run(now)
+    session.execute(update(ScheduledReport), [{'user_id': user_id, 'next_run': next_run} for user_id, _ in due])
+    session.commit()
+
+    messages = [(telegram_id, format_weekly_summary(by_user[user_id], start, end))
+                for user_id, telegram_id in due if user_id in by_user]
+    return [(user_id, next_run) for user_id, _ in due], messages
+
+
+def format_recurring_rules(session, user_id):
+    rules = session.execute(
+        select(RecurringRule.id, RecurringRule.amount, RecurringRule.day_of_month, RecurringRule.next_run,
+               Category.name, Category.type)
+        .join(Category, Category.id == RecurringRule.category_id)
+        .where(RecurringRule.user_id == user_id).order_by(RecurringRule.id)
+    ).all()
+    if not rules:
+        return f"🔁 Регулярных операций пока нет.\n\n{RECURRING_HELP_TEXT}"
+    lines = ["🔁 Регулярные операции:\n"]
+    for rule in rules:
+        type_text = 'доход' if rule.type == CategoryType.income else 'трата'
+        lines.append(f"{rule.id}. {type_text} {format_money(rule.amount)}₽ {rule.name} — {rule.day_of_month} числа, "
+                     f"следующая {rule.next_run.strftime('%d.%m.%Y')}")
+    return "\n".join(lines)
+
+
+def recurring_command(session, user_id, text, now):
+    """/recurring [удалить <номер> | <тип> <сумма> <категория> <число>].
+
+    Возвращает (ответ, задача для планировщика или None).
+    """
+    text = text.strip().lower()
+    if not text:
+        return format_recurring_rules(session, user_id), None
+
+    parts = text.split()
+    if parts[0] == 'удалить':
+        if len(parts) != 2 or not parts[1].isdigit():
+            return RECURRING_HELP_TEXT, None
+        deleted = session.execute(
+            delete(RecurringRule).where(RecurringRule.id == int(parts[1]), RecurringRule.user_id == user_id)
+        ).rowcount
+        session.commit()
+        # Запись в куче планировщика останется и будет пропущена при срабатывании
+        return ("🗑 Регулярная операция удалена." if deleted else "❌ Нет регулярной операции с таким номером."), None
+
+    match = RECURRING_RE.fullmatch(text)
+    if not match:
+        return RECURRING_HELP_TEXT, None
+    type_text, amount_text, category_name, day_text = match.groups()
+    if type_text not in services.TYPE_MAP:
+        return "❌ Первое слово должно быть 'трата' или 'доход'.", None
+    day = int(day_text)
+    if not 1 <= day <= 31:
+        return "❌ Число месяца должно быть от 1 до 31.", None
+    amount = Money.parse(amount_text)
+    if amount <= 0:
+        return "❌ Сумма должна быть больше нуля.", None
+    category_id = services.get_category_id(session, user_id, category_name, services.TYPE_MAP[type_text])
+    if not category_id:
+        return f"❌ Категория '{category_name}' не найдена. Добавь её через /add_category", None
+
+    rule = RecurringRule(user_id=user_id, category_id=category_id, amount=amount, day_of_month=day,
+                         next_run=next_monthly_run(day, now))
+    session.add(rule)
+    session.commit()
+    logger.info(f"Регулярная операция {rule.id} для пользователя {user_id}: {amount}₽, {day} числа")
+    reply = (f"✅ {type_text.capitalize()} {amount}₽ по категории '{category_name}' будет записываться "
+             f"{day} числа каждого месяца. Первая запись: {rule.next_run.strftime('%d.%m.%Y')}.")
+    return reply, ('recurring', rule.id, rule.next_run)
+
+
+def weekly_command(session, user_id, now):
+    """/weekly включает и выключает еженедельную сводку. Возвращает (ответ, задача или None)"""
+    deleted = session.execute(delete(ScheduledReport).where(ScheduledReport.user_id == user_id)).rowcount
+    if deleted:
+        session.commit()
+        return "🔕 Еженедельная сводка выключена.", None
+    next_run = next_weekly_run(now)
+    session.add(ScheduledReport(user_id=user_id, next_run=next_run))
+    session.commit()
+    return (f"🗓 Еженедельная сводка включена: по понедельникам в {RUN_HOUR}:00, "
+            f"первая — {next_run.strftime('%d.%m.%Y')}."), ('weekly', user_id, next_run)
+
+
+def create_scheduler(config, session_factory, send):
+    """Планировщик и очередь уведомлений из секции [SCHEDULER]; send(chat_id, text) — синхронная отправка.
+
+    Потоки не запускаются: это делает Scheduler.start() при старте бота.
+    """
+    outbox = Outbox(send, rate=config.getfloat('SCHEDULER', 'messages_per_second', fallback=25))
+
+    def batch_job(run):
+        def handler(keys, now):
+            with closing(session_factory()) as session:
+                scheduled, messages = run(session, keys, now)
+            for chat_id, text in messages:
+                outbox.put(chat_id, text)
+            return scheduled
+        return handler
+
+    def loader():
+        with closing(session_factory()) as session:
+            return load_jobs(session)
+
+    return Scheduler(
+        {'recurring': batch_job(run_recurring_rules), 'weekly': batch_job(run_weekly_reports)},
+        loader=loader,
+        batch_size=config.getint('SCHEDULER', 'batch_size', fallback=500),
+        outbox=outbox,
+        reload_interval=timedelta(minutes=config.getint('SCHEDULER', 'reload_minutes', fallback=15)) or None
+    )
@@ -0,0 +1,157 @@
+# reports.py
+"""Построение отчётов за период на уровне SQL Core.
+
+build_report_data не зависит от Telegram: её можно вызывать из обработчиков,
+бенчмарков и других форматов отчётов (экспорт, графики).
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, union_all
+from models import Category, CategoryType, Transaction, DailyRollup
+from money import format_money
+
+categories = Category.__table__
+transactions = Transaction.__table__
+daily_rollups = DailyRollup.__table__
+
+NO_DATA_TEXT = "📭 Нет данных за выбранный период"
+
+
+@dataclass
+class CategoryTotal:
+    name: str
+    type: CategoryType
+    total: int  # копейки
+    count: int
+
+
+@dataclass
+class ReportData:
+    start: datetime = None
+    end: datetime = None
+    categories: list = field(default_factory=list)
+    income_total: int = 0  # копейки
+    expense_total: int = 0
+    tx_count: int = 0
+
+    @property
+    def balance(self):
+        return self.income_total - self.expense_total
+
+    def by_type(self, category_type):
+        return [item for item in self.categories if item.type == category_type]
+
+
+def _next_midnight(moment):
+    midnight = datetime.combine(moment.date(), datetime.min.time())
+    return midnight if midnight == moment else midnight + timedelta(days=1)
+
+
+def _raw_part(user_id, start, end):
+    query = select(
+        transactions.c.category_id,
+        func.sum(transactions.c.amount).label('total'),
+        func.count().label('count')
+    ).where(transactions.c.user_id == user_id)
+    if start is not None:
+        query = query.where(transactions.c.date >= start)
+    if end is not None:
+        query = query.where(transactions.c.date < end)
+    return query.group_by(transactions.c.category_id)
+
+
+def _period_parts(user_id, start, end):
+    """Части периода [start, end): полные дни из агрегатов, края — из сырых транзакций"""
+    first_day = _next_midnight(start).date() if start is not None else None
+    last_day = end.date() if end is not None else None
+
+    if first_day is not None and last_day is not None and first_day >= last_day:
+        return [_raw_part(user_id, start, end)]
+
+    parts = []
+    rollup = select(
+        daily_rollups.c.category_id,
+        func.sum(daily_rollups.c.total).label('total'),
+        func.sum(daily_rollups.c.count).label('count')
+    ).where(daily_rollups.c.user_id == user_id)
+    if first_day is not None:
+        rollup = rollup.where(daily_rollups.c.day >= first_day)
+        if start.date() != first_day:
+            parts.append(_raw_part(user_id, start, datetime.combine(first_day, datetime.min.time())))
+    if last_day is not None:
+        rollup = rollup.where(daily_rollups.c.day < last_day)
+        last_midnight = datetime.combine(last_day, datetime.min.time())
+        if end != last_midnight:
+            parts.append(_raw_part(user_id, last_midnight, end))
+    parts.append(rollup.group_by(daily_rollups.c.category_id))
+    return parts
+
+
+def report_query(user_id, start=None, end=None):
+    """Один запрос: суммы по категориям, итоги по типам и общее число транзакций.
+
+    Итоги по типам и количество считаются оконными функциями поверх
+    сгруппированных строк, поэтому второй запрос не нужен.
+    """
+    parts = _period_parts(user_id, start, end)
+    period = (union_all(*parts) if len(parts) > 1 else parts[0]).subquery()
+
+    total = func.sum(period.c.total)
+    count = func.sum(period.c.count)
+    return select(
+        categories.c.name,
+        categories.c.type,
+        total.label('total'),
+        count.label('count'),
+        func.sum(total).over(partition_by=categories.c.type).label('type_total'),
+        func.sum(count).over().label('tx_count')
+    ).select_from(
+        categories.join(period, categories.c.id == period.c.category_id)
+    ).group_by(
+        categories.c.id, categories.c.name, categories.c.type
+    ).having(count > 0).order_by(categories.c.type, total.desc())
+
+
+def build_report_data(connection, user_id, start=None, end=None):
+    """Данные отчёта за [start, end); connection — Connection или Session"""
+    data = ReportData(start=start, end=end)
+    for row in connection.execute(report_query(user_id, start, end)):
+        data.categories.append(CategoryTotal(row.name, row.type, row.total, row.count))
+        data.tx_count = row.tx_count
+        if row.type == CategoryType.income:
+            data.income_total = row.type_total
+        else:
+            data.expense_total = row.type_total
+    return data
+
+
+def format_report(data):
+    """Текст отчёта для Telegram"""
+    if not data.categories:
+        return NO_DATA_TEXT
+
+    if data.start and data.end:
+        period_title = (f"📊 Отчёт за период с {data.start.strftime('%d.%m.%Y')} "
+                        f"по {(data.end - timedelta(days=1)).strftime('%d.%m.%Y')}")
+    else:
+        period_title = "📊 Отчёт за всё время"
+
+    report = [period_title]
+
+    income_details = data.by_type(CategoryType.income)
+    if income_details:
+        report.append("\n💰 Доходы:")
+        for item in income_details:
+            report.append(f"  - {item.name}: {format_money(item.total)}₽")
+        report.append(f"  Итого доходы: {format_money(data.income_total)}₽")
+
+    expense_details = data.by_type(CategoryType.expense)
+    if expense_details:
+        report.append("\n💸 Расходы:")
+        for item in expense_details:
+            report.append(f"  - {item.name}: {format_money(item.total)}₽")
+        report.append(f"  Итого расходы: {format_money(data.expense_total)}₽")
+
+    report.append(f"\n📈 Баланс: {format_money(data.balance)}₽")
+    report.append(f"Всего транзакций: {data.tx_count}")
+    return "\n".join(report)
@@ -0,0 +1,141 @@
+# rollups.py
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Transaction, DailyRollup, MonthlySpend
+from datetime import datetime
+
+def _day(date):
+    return date.date() if isinstance(date, datetime) else date
+
+
+def add_to_rollups(session, rows):
+    """Добавляет транзакции (user_id, category_id, date, amount) в дневные агрегаты и суммы месяцев.
+
+    Вызывается в той же сессии, что и вставка транзакций, чтобы агрегаты
+    фиксировались одним коммитом с сырыми строками. Возвращает сумму месяца
+    по категории сразу после каждой строки (в порядке rows) — по ней
+    проверяются бюджеты без отдельного запроса с SUM.
+    """
+    if not rows:
+        return []
+    deltas = {}
+    month_deltas = {}
+    for user_id, category_id, date, amount in rows:
+        day = _day(date)
+        key = (user_id, day, category_id)
+        total, count = deltas.get(key, (0, 0))
+        deltas[key] = (total + amount, count + 1)
+        month_key = (user_id, category_id, day.replace(day=1))
+        month_deltas[month_key] = month_deltas.get(month_key, 0) + amount
+
+    values = [
+        {"user_id": user_id, "day": day, "category_id": category_id, "total": total, "count": count}
+        for (user_id, day, category_id), (total, count) in deltas.items()
+    ]
+    # Один закэшированный оператор и executemany: SQLAlchemy сам делит строки
+    # на пачки в пределах лимита параметров SQLite
+    stmt = sqlite_insert(DailyRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DailyRollup.user_id, DailyRollup.day, DailyRollup.category_id],
+        set_={
+            "total": DailyRollup.total + stmt.excluded.total,
+            "count": DailyRollup.count + stmt.excluded.count,
+        }
+    )
+    session.execute(stmt, values)
+
+    # Новые суммы месяцев возвращаются тем же UPSERT (RETURNING, SQLite 3.35+)
+    values = [
+        {"user_id": user_id, "category_id": category_id, "month": month, "total": total}
+        for (user_id, category_id, month), total in month_deltas.items()
+    ]
+    month_totals = {}
+    stmt = sqlite_insert(MonthlySpend)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MonthlySpend.user_id, MonthlySpend.category_id, MonthlySpend.month],
+        set_={"total": MonthlySpend.total + stmt.excluded.total}
+    ).returning(MonthlySpend.user_id, MonthlySpend.category_id, MonthlySpend.month, MonthlySpend.total)
+    for user_id, category_id, month, total in session.execute(stmt, values):
+        month_totals[(user_id, category_id, month)] = total
+
+    # Сумма после каждой строки: от итога пачки вычитаются суммы следующих строк
+    running = []
+    for user_id, category_id, date, amount in reversed(rows):
+        key = (user_id, category_id, _day(date).replace(day=1))
+        running.append(month_totals[key])
+        month_totals[key] -= amount
+    running.reverse()
+    return running
+
+
+def _raw_aggregate(user_id=None):
+    """Агрегат сырых транзакций в разрезе (пользователь, день, категория)"""
+    day = func.date(Transaction.date)
+    query = select(
+        Transaction.user_id,
+        day.label('day'),
+        Transaction.category_id,
+        func.sum(Transaction.amount).label('total'),
+        func.count().label('count')
+    ).group_by(Transaction.user_id, day, Transaction.category_id)
+    if user_id is not None:
+        query = query.where(Transaction.user_id == user_id)
+    return query
+
+
+def _raw_monthly_aggregate(user_id=None):
+    month = func.date(Transaction.date, 'start of month')
+    query = select(
+        Transaction.user_id,
+        Transaction.category_id,
+        month.label('month'),
+        func.sum(Transaction.amount).label('total')
+    ).group_by(Transaction.user_id, Transaction.category_id, month)
+    if user_id is not None:
+        query = query.where(Transaction.user_id == user_id)
+    return query
+
+
+def _rebuild(session, model, aggregate, columns, user_id):
+    cleanup = delete(model)
+    if user_id is not None:
+        cleanup = cleanup.where(model.user_id == user_id)
+    session.execute(cleanup)
+    session.execute(sqlite_insert(model).from_select(columns, aggregate(user_id)))
+
+
+def rebuild_monthly_spend(session, user_id=None):
+    """Пересчитывает суммы месяцев из сырых транзакций"""
+    _rebuild(session, MonthlySpend, _raw_monthly_aggregate, ['user_id', 'category_id', 'month', 'total'], user_id)
+
+
+def rebuild_rollups(session, user_id=None):
+    """Пересчитывает агрегаты и суммы месяцев из сырых транзакций (для всех или одного пользователя)"""
+    _rebuild(session, DailyRollup, _raw_aggregate, ['user_id', 'day', 'category_id', 'total', 'count'], user_id)
+    rebuild_monthly_spend(session, user_id)
+
+
+def check_rollups(session, user_id=None):
+    """Сравнивает агрегаты с сырыми транзакциями и возвращает расходящиеся ключи"""
+    expected = {
+        (row.user_id, str(row.day), row.category_id): (row.total, row.count)
+        for row in session.execute(_raw_aggregate(user_id))
+    }
+    query = select(DailyRollup.user_id, DailyRollup.day, DailyRollup.category_id,
+                   DailyRollup.total, DailyRollup.count)
+    if user_id is not None:
+        query = query.where(DailyRollup.user_id == user_id)
+    actual = {
+        (row.user_id, row.day.isoformat(), row.category_id): (row.total, row.count)
+        for row in session.execute(query)
+        if row.count
+    }
+
+    mismatched = []
+    for key in expected.keys() | actual.keys():
+        exp_total, exp_count = expected.get(key, (0, 0))
+        act_total, act_count = actual.get(key, (0, 0))
+        # Суммы в копейках сравниваются точно
+        if exp_count != act_count or exp_total != act_total:
+            mismatched.append(key)
+    return sorted(mismatched)
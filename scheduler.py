@@ -0,0 +1,212 @@
+# scheduler.py
+"""Планировщик отложенных задач и ограниченная по частоте отправка уведомлений.
+
+Scheduler держит задачи (срок, вид, ключ) в куче и спит на условной
+переменной до ближайшего срока: новые задачи с более ранним сроком будят
+поток, опроса по таймеру нет. Наступившие задачи снимаются пачкой и
+передаются обработчику своего вида одним вызовом, чтобы он мог работать с
+базой групповыми запросами. Задачи, созданные другими процессами бота,
+подхватываются периодическим перечитыванием из базы (reload_interval).
+
+Outbox — очередь исходящих сообщений с одним потоком отправки и
+ограничением частоты (RateLimiter), чтобы не упираться в лимиты Telegram.
+"""
+from datetime import datetime, timedelta
+import heapq
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+# Через сколько повторить пачку, если обработчик упал
+RETRY_DELAY = timedelta(minutes=1)
+# Служебная задача: перечитать кучу из базы через loader
+RELOAD = 'reload'
+
+
+class Scheduler:
+    """Один поток и куча задач.
+
+    handlers: вид задачи -> fn(ключи, now), возвращающая [(ключ, следующий срок)].
+    Срок хранится в базе, а куча — только индекс в памяти: устаревшие записи
+    (задача перенесена или удалена) обработчик просто пропускает.
+    """
+
+    def __init__(self, handlers, loader=None, batch_size=500, outbox=None, reload_interval=None):
+        self.handlers = handlers
+        self.loader = loader  # () -> [(вид, ключ, срок)] при старте и перечитывании
+        self.batch_size = batch_size
+        self.reload_interval = reload_interval  # timedelta или None
+        self.outbox = outbox
+        self._heap = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self.runs = 0
+        self.jobs = 0
+
+    def schedule(self, kind, key, due):
+        with self._cond:
+            heapq.heappush(self._heap, (due, kind, key))
+            # Будим поток, только если срок стал ближайшим
+            if self._heap[0][0] == due:
+                self._cond.notify()
+
+    def start(self):
+        jobs = list(self.loader()) if self.loader else []
+        with self._cond:
+            for kind, key, due in jobs:
+                self._heap.append((due, kind, key))
+            if self.loader and self.reload_interval:
+                self._heap.append((datetime.now() + self.reload_interval, RELOAD, 0))
+            heapq.heapify(self._heap)
+        logger.info(f"Планировщик запущен, задач: {len(jobs)}")
+        if self.outbox:
+            self.outbox.start()
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+        if self.outbox:
+            self.outbox.close()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _next_batch(self):
+        """Ждёт ближайшего срока и снимает с кучи до batch_size наступивших задач"""
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = (self._heap[0][0] - datetime.now()).total_seconds()
+                if delay <= 0:
+                    break
+                self._cond.wait(delay)
+            if self._stopped:
+                return None, None
+
+            now = datetime.now()
+            batch = {}
+            count = 0
+            while self._heap and self._heap[0][0] <= now and count < self.batch_size:
+                _, kind, key = heapq.heappop(self._heap)
+                batch.setdefault(kind, set()).add(key)
+                count += 1
+            return now, batch
+
+    def _run(self):
+        while True:
+            now, batch = self._next_batch()
+            if batch is None:
+                return
+            for kind, keys in batch.items():
+                try:
+                    handler = self._reload if kind == RELOAD else self.handlers[kind]
+                    scheduled = handler(sorted(keys), now)
+                except Exception as e:
+                    logger.error(f"Ошибка в задачах '{kind}' ({len(keys)} шт.): {str(e)}")
+                    scheduled = [(key, now + RETRY_DELAY) for key in keys]
+                self.runs += 1
+                self.jobs += len(keys)
+                for key, due in scheduled:
+                    if due is not None:
+                        self.schedule(kind, key, due)
+
+    def _reload(self, keys, now):
+        """Заменяет кучу задачами из базы: так подхватываются задачи других процессов.
+
+        База — источник истины, поэтому записи кучи, поставленные этим
+        процессом, в ней тоже есть; дубликаты обработчики пропускают.
+        """
+        jobs = list(self.loader())
+        with self._cond:
+            self._heap = [(due, kind, key) for kind, key, due in jobs]
+            heapq.heapify(self._heap)
+            self._cond.notify()
+        logger.info(f"Задачи планировщика перечитаны: {len(jobs)}")
+        return [(0, now + self.reload_interval)]
+
+
+class RateLimiter:
+    """Token bucket: в среднем не больше rate событий в секунду, всплеск до burst"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Занимает токен; при пустой корзине спит ровно до его появления"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Outbox:
+    """Исходящие уведомления: очередь и один поток отправки с ограничением частоты"""
+
+    def __init__(self, send, rate=25, burst=5):
+        self.send = send  # send(chat_id, text)
+        self.limiter = RateLimiter(rate, burst)
+        self._queue = queue.Queue()
+        self.sent = 0
+        self.failed = 0
+        self._thread = None
+
+    def start(self):
+        """Запускает поток отправки; до этого уведомления только копятся в очереди"""
+        self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+        self._thread.start()
+
+    def put(self, chat_id, text):
+        self._queue.put((chat_id, text))
+
+    def close(self):
+        """Дожидается отправки очереди и останавливает поток"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            chat_id, text = item
+            self.limiter.acquire()
+            try:
+                self._send(chat_id, text)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Не удалось отправить уведомление в чат {chat_id}: {str(e)}")
+
+    def _send(self, chat_id, text):
+        try:
+            self.send(chat_id, text)
+        except Exception as e:
+            # 429 Too Many Requests: Telegram сообщает, сколько подождать
+            retry_after = (getattr(e, 'result_json', None) or {}).get('parameters', {}).get('retry_after')
+            if not retry_after:
+                raise
+            logger.warning(f"Лимит Telegram, пауза {retry_after} с")
+            time.sleep(retry_after)
+            self.send(chat_id, text)
@@ -0,0 +1,431 @@
+# services.py
+"""Бизнес-логика бота, общая для синхронного и асинхронного режимов.
+
+Функции принимают синхронную сессию SQLAlchemy и возвращают текст ответа,
+поэтому асинхронные обработчики вызывают их через AsyncSession.run_sync.
+"""
+from sqlalchemy import and_, delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from models import User, Category, CategoryType, Transaction, Budget, MonthlySpend
+from rollups import add_to_rollups
+from reports import build_report_data, format_report
+from trends import auto_granularity, bucket_label, build_trend, first_day, format_trend, trend_period
+from charts import render_bars, render_pie
+from cache import LRUCache, CategoryCache, ReportCache
+from money import AMOUNT_PATTERN, Money, format_money
+import hashlib
+import logging
+import re
+from datetime import datetime, timedelta
+from calendar import monthrange
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d"
+BUDGET_HELP_TEXT = ("Задать месячный лимит категории трат: /budget <категория> <сумма>\n"
+                    "Пример: /budget кафе 10000\nУдалить: /budget кафе 0")
+TYPE_MAP = {"трата": CategoryType.expense, "доход": CategoryType.income}
+TREND_GRANULARITIES = {"день": "day", "неделя": "week", "месяц": "month"}
+# 'трата 1 200,50 кафе': сумма может содержать пробелы между разрядами
+TRANSACTION_RE = re.compile(rf"(\S+)\s+({AMOUNT_PATTERN})\s+(\S+)")
+
+# telegram_id -> User.id. Идентификатор пользователя практически не меняется,
+# поэтому большинство сообщений обходится без запроса. Промахи не кэшируются:
+# пользователя может зарегистрировать другой процесс
+user_id_cache = LRUCache(maxsize=50000, ttl=3600, name='user_ids')
+
+# User.id -> {(название, тип): Category.id}; после первой загрузки ввод
+# транзакции не требует запроса категории
+category_cache = CategoryCache(max_entries=200000, name='categories')
+
+# (User.id, начало, конец) -> готовый текст отчёта; сбрасывается записями в период.
+# Записи других процессов бота кэш не видит, поэтому отчёт устаревает не позже ttl
+report_cache = ReportCache(maxsize=20000, ttl=300, name='reports')
+
+# (User.id, вид, начало, конец, отпечаток данных) -> file_id загруженной картинки.
+# Отпечаток меняется вместе с данными графика, поэтому сбрасывать кэш не нужно
+chart_file_ids = LRUCache(maxsize=20000, name='chart_file_ids')
+
+# User.id -> {Category.id: (название, лимит)}; бюджеты меняются только через set_budget,
+# а set_budget в другом процессе становится виден здесь не позже ttl
+budget_cache = LRUCache(maxsize=50000, ttl=300, name='budgets')
+# Пороги уведомлений в процентах лимита, от большего к меньшему
+BUDGET_THRESHOLDS = (100, 80)
+
+
+def find_user_id(session, telegram_id):
+    """Внутренний id пользователя по telegram_id или None, если он не зарегистрирован"""
+    user_id = user_id_cache.get(telegram_id)
+    if user_id is None:
+        user_id = session.query(User.id).filter_by(telegram_id=telegram_id).scalar()
+        if user_id is not None:
+            user_id_cache.set(telegram_id, user_id)
+    return user_id
+
+
+def configure_caches(config):
+    """Время жизни кэшей из секции [CACHE]: report_ttl_seconds, budget_ttl_seconds (0 — без ограничения)"""
+    report_cache.ttl = config.getint('CACHE', 'report_ttl_seconds', fallback=300) or None
+    budget_cache.ttl = config.getint('CACHE', 'budget_ttl_seconds', fallback=300) or None
+
+
+def cache_stats():
+    """Размеры и счётчики попаданий кэшей для подбора лимитов"""
+    return [user_id_cache.stats(), category_cache.stats(), report_cache.stats(), chart_file_ids.stats(),
+            budget_cache.stats()]
+
+
+def category_map(session, user_id):
+    """Словарь {(название, тип): id} категорий пользователя; база читается один раз на пользователя"""
+    def load(uid):
+        rows = session.query(Category.name, Category.type, Category.id).filter_by(user_id=uid)
+        return (((row_name, row_type), row_id) for row_name, row_type, row_id in rows)
+
+    return category_cache.get_map(user_id, load)
+
+
+def find_categories(session, user_id, keys):
+    """Ищет в базе категории {(название, тип)}, которых нет в кэше, и дописывает найденные в кэш.
+
+    Их мог создать другой процесс бота; словарь пользователя при этом не перечитывается.
+    """
+    names = {name for name, _ in keys}
+    rows = session.query(Category.name, Category.type, Category.id).filter(
+        Category.user_id == user_id, Category.name.in_(names)
+    )
+    found = {(name, category_type): category_id for name, category_type, category_id in rows
+             if (name, category_type) in keys}
+    for (name, category_type), category_id in found.items():
+        category_cache.add(user_id, name, category_type, category_id)
+    return found
+
+
+def get_category_id(session, user_id, name, category_type, recheck=True):
+    """Id категории пользователя или None.
+
+    При промахе кэша (и recheck) категория ищется одним запросом по уникальному индексу.
+    """
+    category_id = category_map(session, user_id).get((name, category_type))
+    if category_id is None and recheck:
+        category_id = session.query(Category.id).filter_by(
+            user_id=user_id, type=category_type, name=name
+        ).scalar()
+        if category_id is not None:
+            category_cache.add(user_id, name, category_type, category_id)
+    return category_id
+
+
+def register_user(session, from_user):
+    """Создаёт пользователя, если его ещё нет. Возвращает True для нового пользователя"""
+    if session.query(User.id).filter_by(telegram_id=from_user.id).scalar():
+        logger.info(f"Пользователь уже существует: {from_user.id}")
+        return False
+
+    user = User(
+        telegram_id=from_user.id,
+        username=from_user.username,
+        first_name=from_user.first_name,
+        last_name=from_user.last_name
+    )
+    session.add(user)
+    session.commit()
+    user_id_cache.set(from_user.id, user.id)
+    logger.info(f"Создан новый пользователь: {from_user.id}")
+    return True
+
+
+def add_category(session, user_id, text):
+    parts = text.strip().lower().split()
+    if len(parts) != 2:
+        return "❌ Неверный формат. Попробуй ещё раз."
+
+    type_text, category_name = parts
+    if type_text not in TYPE_MAP:
+        return "❌ Тип должен быть 'трата' или 'доход'."
+
+    # Проверка существования категории; созданную другим процессом поймает уникальный индекс ниже
+    if get_category_id(session, user_id, category_name, TYPE_MAP[type_text], recheck=False):
+        return f"ℹ️ Категория '{category_name}' уже существует."
+
+    category = Category(
+        user_id=user_id,
+        name=category_name,
+        type=TYPE_MAP[type_text]
+    )
+    session.add(category)
+    try:
+        session.flush()
+        category_id = category.id
+        session.commit()
+    except IntegrityError:
+        # Параллельный запрос успел создать такую же категорию, кэш пользователя устарел
+        session.rollback()
+        category_cache.invalidate(user_id)
+        return f"ℹ️ Категория '{category_name}' уже существует."
+    category_cache.add(user_id, category_name, TYPE_MAP[type_text], category_id)
+    report_cache.invalidate(user_id)
+    logger.info(f"Добавлена категория: {category_name} для пользователя {user_id}")
+    return f"✅ Категория '{category_name}' добавлена!"
+
+
+def prepare_transaction(session, user_id, text):
+    """Разбирает сообщение 'трата <сумма> <категория>'.
+
+    Возвращает (строка транзакции, подтверждение для отправки после записи)
+    или (None, текст ошибки для пользователя).
+    """
+    text = text.strip().lower()
+    if len(text.split()) < 3:
+        return None, "❌ Неверный формат. Пример: трата 300 кафе"
+
+    match = TRANSACTION_RE.match(text)
+    if not match:
+        return None, "❌ Неверный формат суммы. Пример: трата 300 кафе"
+    type_text, amount_text, category_name = match.groups()
+    amount = Money.parse(amount_text)
+
+    if type_text not in TYPE_MAP:
+        return None, "❌ Первое слово должно быть 'трата' или 'доход'. Пример: трата 300 кафе"
+    # Тип задаётся словом, а не знаком: отрицательная сумма не переживёт экспорт и импорт
+    if amount <= 0:
+        return None, "❌ Сумма должна быть больше нуля."
+
+    # Найти категорию
+    category_id = get_category_id(session, user_id, category_name, TYPE_MAP[type_text])
+    if not category_id:
+        return None, f"❌ Категория '{category_name}' не найдена. Добавь её через /add_category"
+
+    row = {
+        'user_id': user_id,
+        'category_id': category_id,
+        'amount': amount,
+        'date': datetime.now(),
+    }
+    emoji = "💸" if type_text == "трата" else "💰"
+    confirmation = f"{emoji} {'Доход' if type_text == 'доход' else 'Трата'} {amount}₽ по категории '{category_name}' сохранена."
+    return row, confirmation
+
+
+def save_transaction(session, row):
+    """Сохраняет транзакцию отдельным коммитом вместе с агрегатами.
+
+    Возвращает сумму месяца по категории после записи (для budget_alert).
+    """
+    session.add(Transaction(**row))
+    month_total, = add_to_rollups(session, [(row['user_id'], row['category_id'], row['date'], row['amount'])])
+    session.commit()
+    transactions_committed([row])
+    logger.info(f"Добавлена транзакция: {row['amount']}₽ по категории {row['category_id']} "
+                f"для пользователя {row['user_id']}")
+    return month_total
+
+
+def transactions_committed(rows):
+    """Сбрасывает закэшированные отчёты, в период которых попали записанные транзакции"""
+    for row in rows:
+        report_cache.invalidate(row['user_id'], row['date'])
+
+
+def add_transaction(session, user_id, text):
+    row, reply = prepare_transaction(session, user_id, text)
+    if row:
+        month_total = save_transaction(session, row)
+        reply = with_budget_alert(session, row, month_total, reply)
+    return reply
+
+
+def budget_limits(session, user_id):
+    """Бюджеты пользователя {Category.id: (название, лимит)}; база читается не чаще раза в ttl кэша"""
+    budgets = budget_cache.get(user_id)
+    if budgets is None:
+        rows = session.query(Budget.category_id, Category.name, Budget.amount).join(
+            Category, Category.id == Budget.category_id
+        ).filter(Budget.user_id == user_id)
+        budgets = {category_id: (name, amount) for category_id, name, amount in rows}
+        budget_cache.set(user_id, budgets)
+    return budgets
+
+
+def preload_budget_limits(session, user_ids):
+    """Заполняет кэш бюджетов для пачки пользователей одним запросом (для задач планировщика)"""
+    missing = {user_id for user_id in user_ids if budget_cache.get(user_id) is None}
+    if not missing:
+        return
+    budgets = {user_id: {} for user_id in missing}
+    rows = session.query(Budget.user_id, Budget.category_id, Category.name, Budget.amount).join(
+        Category, Category.id == Budget.category_id
+    ).filter(Budget.user_id.in_(missing))
+    for user_id, category_id, name, amount in rows:
+        budgets[user_id][category_id] = (name, amount)
+    for user_id, limits in budgets.items():
+        budget_cache.set(user_id, limits)
+
+
+def budget_alert(session, row, month_total):
+    """Уведомление, если транзакция row довела сумму месяца до порога бюджета; иначе None"""
+    budget = budget_limits(session, row['user_id']).get(row['category_id'])
+    if budget is None:
+        return None
+    name, limit = budget
+    previous = month_total - row['amount']
+    for threshold in BUDGET_THRESHOLDS:
+        # Срабатывает только на транзакции, пересёкшей порог, а не на каждой следующей
+        if previous * 100 < limit * threshold <= month_total * 100:
+            if threshold >= 100:
+                return (f"🚨 Бюджет по категории '{name}' исчерпан: "
+                        f"{format_money(month_total)}₽ из {format_money(limit)}₽")
+            return (f"⚠️ Потрачено {month_total * 100 // limit}% бюджета по категории '{name}': "
+                    f"{format_money(month_total)}₽ из {format_money(limit)}₽")
+    return None
+
+
+def with_budget_alert(session, row, month_total, reply):
+    alert = budget_alert(session, row, month_total)
+    return f"{reply}\n\n{alert}" if alert else reply
+
+
+def set_budget(session, user_id, category_name, amount_text, today):
+    """'/budget кафе 10000' — лимит расходов категории на месяц, сумма 0 удаляет бюджет"""
+    category_id = get_category_id(session, user_id, category_name, CategoryType.expense)
+    if not category_id:
+        return f"❌ Категория трат '{category_name}' не найдена. Добавь её через /add_category"
+    try:
+        amount = Money.parse(amount_text)
+    except ValueError:
+        return "❌ Неверный формат суммы. Пример: /budget кафе 10000"
+    if amount < 0:
+        return "❌ Бюджет не может быть отрицательным."
+
+    if amount == 0:
+        session.execute(delete(Budget).where(Budget.user_id == user_id, Budget.category_id == category_id))
+        reply = f"🗑 Бюджет по категории '{category_name}' удалён."
+    else:
+        stmt = sqlite_insert(Budget).values(user_id=user_id, category_id=category_id, amount=amount)
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[Budget.user_id, Budget.category_id], set_={"amount": stmt.excluded.amount}
+        ))
+        spent = session.get(MonthlySpend, (user_id, category_id, today.replace(day=1)))
+        spent = spent.total if spent else 0
+        reply = (f"✅ Бюджет по категории '{category_name}': {amount}₽ в месяц.\n"
+                 f"В этом месяце потрачено {format_money(spent)}₽ ({spent * 100 // amount}%).")
+    session.commit()
+    budget_cache.invalidate(user_id)
+    logger.info(f"Бюджет категории {category_id} пользователя {user_id}: {amount}₽")
+    return reply
+
+
+def format_budgets(session, user_id, today):
+    """Бюджеты пользователя с тратами текущего месяца"""
+    rows = session.execute(
+        select(Category.name, Budget.amount, MonthlySpend.total).join(
+            Category, Category.id == Budget.category_id
+        ).outerjoin(
+            MonthlySpend, and_(MonthlySpend.user_id == Budget.user_id,
+                               MonthlySpend.category_id == Budget.category_id,
+                               MonthlySpend.month == today.replace(day=1))
+        ).where(Budget.user_id == user_id).order_by(Category.name)
+    ).all()
+    if not rows:
+        return f"💼 Бюджетов пока нет.\n\n{BUDGET_HELP_TEXT}"
+
+    lines = [f"💼 Бюджеты на {today.strftime('%m.%Y')}:\n"]
+    for name, limit, spent in rows:
+        spent = spent or 0
+        mark = "🚨" if spent >= limit else "⚠️" if spent * 100 >= limit * BUDGET_THRESHOLDS[-1] else "✅"
+        lines.append(f"{mark} {name}: {format_money(spent)}₽ из {format_money(limit)}₽ ({spent * 100 // limit}%)")
+    return "\n".join(lines)
+
+
+def handle_budget_command(session, user_id, args, today):
+    """/budget — список бюджетов, /budget <категория> <сумма> — установка"""
+    if not args:
+        return format_budgets(session, user_id, today)
+    if len(args) < 2:
+        return BUDGET_HELP_TEXT
+    return set_budget(session, user_id, args[0], ' '.join(args[1:]), today)
+
+
+def period_bounds(period_type, today):
+    """Границы [start, end) для готовых периодов отчёта.
+
+    Для 'все время' возвращает (None, None), для неизвестного периода — None.
+    """
+    if period_type == 'текущий день':
+        return today, today + timedelta(days=1)
+    if period_type == 'текущая неделя':
+        # Начало недели (понедельник)
+        start_date = today - timedelta(days=today.weekday())
+        return start_date, start_date + timedelta(days=7)
+    if period_type == 'текущий месяц':
+        start_date = today.replace(day=1)
+        # Конец месяца
+        _, last_day = monthrange(today.year, today.month)
+        return start_date, start_date + timedelta(days=last_day)
+    if period_type == 'текущий год':
+        return today.replace(month=1, day=1), today.replace(month=12, day=31)
+    if period_type == 'все время':
+        return None, None
+    return None
+
+
+def _period_datetimes(start_date, end_date):
+    if start_date and end_date:
+        # Преобразуем в datetime для сравнения
+        return datetime.combine(start_date, datetime.min.time()), datetime.combine(end_date, datetime.min.time())
+    return None, None
+
+
+def build_report(session, user_id, start_date, end_date):
+    start_datetime, end_datetime = _period_datetimes(start_date, end_date)
+    report = report_cache.get(user_id, start_datetime, end_datetime)
+    if report is None:
+        generation = report_cache.generation(user_id)
+        report = format_report(build_report_data(session, user_id, start_datetime, end_datetime))
+        report_cache.set(user_id, start_datetime, end_datetime, report, generation)
+    return report
+
+
+def build_trend_report(session, user_id, args, today):
+    """Динамика по аргументам '/trend [день|неделя|месяц] [доход]' за последние периоды"""
+    granularity = next((TREND_GRANULARITIES[arg] for arg in args if arg in TREND_GRANULARITIES), 'week')
+    category_type = CategoryType.income if 'доход' in args else CategoryType.expense
+    start, end = trend_period(granularity, today)
+    try:
+        return format_trend(build_trend(session, user_id, category_type, granularity, start, end))
+    except RuntimeError as e:
+        logger.error(f"Отчёт по динамике недоступен: {str(e)}")
+        return "❌ Отчёт по динамике сейчас недоступен."
+
+
+def prepare_chart(session, user_id, kind, start_date, end_date):
+    """Данные графика 'pie' или 'bars' за период.
+
+    Возвращает (ключ для chart_file_ids, функция отрисовки, аргументы)
+    или None, если рисовать нечего.
+    """
+    start_datetime, end_datetime = _period_datetimes(start_date, end_date)
+    if kind == 'pie':
+        # Доли круговой диаграммы не могут быть отрицательными: такие итоги не рисуются
+        items = [item for item in build_report_data(session, user_id, start_datetime, end_datetime)
+                 .by_type(CategoryType.expense) if item.total > 0]
+        if not items:
+            return None
+        render, args = render_pie, ("Расходы по категориям", [item.name for item in items],
+                                    [int(item.total) for item in items])
+    else:
+        if not (start_date and end_date):
+            start_date, end_date = first_day(session, user_id), datetime.now().date() + timedelta(days=1)
+            if start_date is None:
+                return None
+        granularity = auto_granularity(start_date, end_date)
+        income, expense = (build_trend(session, user_id, category_type, granularity, start_date, end_date)
+                           for category_type in (CategoryType.income, CategoryType.expense))
+        if not (income.category_names or expense.category_names):
+            return None
+        render, args = render_bars, ("Доходы и расходы",
+                                     [bucket_label(bucket, granularity) for bucket in income.buckets],
+                                     income.totals.tolist(), expense.totals.tolist())
+
+    fingerprint = hashlib.sha1(repr(args).encode()).hexdigest()
+    return (user_id, kind, start_date, end_date, fingerprint), render, args
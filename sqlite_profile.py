@@ -0,0 +1,79 @@
+# sqlite_profile.py
+from sqlalchemy import create_engine, event
+import configparser
+
+# Профили настроек SQLite. legacy — поведение по умолчанию (журнал отката),
+# performance — WAL, при котором чтение отчётов не блокирует запись транзакций.
+# synchronous=NORMAL в WAL при сбое питания может потерять последние коммиты,
+# поэтому performance включается только явно
+ENGINE_PROFILES = {
+    'legacy': {},
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,  # в КиБ, около 20 МБ на соединение
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,  # мс ожидания блокировки вместо мгновенной ошибки
+    },
+}
+DEFAULT_PROFILE = 'legacy'
+PRAGMA_KEYS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout')
+
+
+def load_database_settings(path='settings.ini'):
+    """Настройки базы из секции [DATABASE] settings.ini.
+
+    profile выбирает набор прагм (по умолчанию legacy), отдельные ключи
+    (journal_mode, synchronous, cache_size, mmap_size, temp_store, busy_timeout)
+    переопределяют его значения.
+    pool_size, max_overflow и pool_timeout задают пул соединений.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+    section = config['DATABASE'] if config.has_section('DATABASE') else {}
+
+    profile = section.get('profile', DEFAULT_PROFILE)
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Неизвестный профиль базы: {profile}. Допустимые: {', '.join(ENGINE_PROFILES)}")
+    pragmas = dict(ENGINE_PROFILES[profile])
+    for key in PRAGMA_KEYS:
+        if key in section:
+            pragmas[key] = section[key]
+
+    return {
+        'path': section.get('path', 'finance_bot.db'),
+        'pragmas': pragmas,
+        'pool_size': int(section.get('pool_size', 10)),
+        'max_overflow': int(section.get('max_overflow', 20)),
+        'pool_timeout': float(section.get('pool_timeout', 30)),
+    }
+
+
+def apply_pragmas(engine, pragmas):
+    """Выставляет прагмы на каждом новом соединении пула"""
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f"PRAGMA {key}={value}")
+        cursor.close()
+
+
+def create_db_engine(path, pragmas=None, pool_size=10, max_overflow=20, pool_timeout=30):
+    """Движок SQLite с пулом соединений для многопоточного бота"""
+    pragmas = pragmas or {}
+    connect_args = {'check_same_thread': False}
+    if 'busy_timeout' in pragmas:
+        connect_args['timeout'] = int(pragmas['busy_timeout']) / 1000
+
+    engine = create_engine(
+        f"sqlite:///{path}",
+        echo=False,
+        connect_args=connect_args,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+    )
+    apply_pragmas(engine, pragmas)
+    return engine
@@ -0,0 +1,136 @@
+# state_store.py
+"""Хранилища состояния диалогов (шаг мастера отчёта и введённые даты).
+
+MemoryStateStore держит состояния в процессе с ограничением размера и TTL,
+SqliteStateStore — в таблице conversation_states, что переживает перезапуск
+и позволяет нескольким процессам бота работать с одной базой.
+"""
+from abc import ABC, abstractmethod
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from cache import LRUCache
+from models import ConversationState
+import json
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в состояние")
+
+
+def _decode(value):
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    if '__date__' in value:
+        return date.fromisoformat(value['__date__'])
+    return value
+
+
+def dump_state(state):
+    return json.dumps(state, default=_encode, ensure_ascii=False)
+
+
+def load_state(text):
+    return json.loads(text, object_hook=_decode)
+
+
+class StateStore(ABC):
+    """Интерфейс хранилища: состояние — словарь, ключ — telegram_id пользователя"""
+
+    # True, если операции обращаются к базе и в асинхронном режиме выносятся в поток
+    blocking = False
+
+    @abstractmethod
+    def get(self, telegram_id):
+        """Состояние пользователя или None"""
+
+    @abstractmethod
+    def set(self, telegram_id, state):
+        """Сохраняет состояние целиком"""
+
+    @abstractmethod
+    def delete(self, telegram_id):
+        """Завершает диалог пользователя"""
+
+
+class MemoryStateStore(StateStore):
+    """Состояния в памяти процесса: брошенные диалоги вытесняются по TTL и LRU"""
+
+    def __init__(self, maxsize=100000, ttl=3600):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl, name='conversation_states')
+
+    def get(self, telegram_id):
+        state = self._cache.get(telegram_id)
+        # Копия, чтобы изменения сохранялись только через set, как и в SqliteStateStore
+        return dict(state) if state is not None else None
+
+    def set(self, telegram_id, state):
+        self._cache.set(telegram_id, dict(state))
+
+    def delete(self, telegram_id):
+        self._cache.invalidate(telegram_id)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class SqliteStateStore(StateStore):
+    """Состояния в таблице conversation_states с истечением по expires_at"""
+
+    blocking = True
+    # Просроченные строки удаляются раз в столько записей
+    PURGE_EVERY = 1000
+
+    def __init__(self, session_factory, ttl=3600):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._writes = 0
+
+    def get(self, telegram_id):
+        with closing(self.session_factory()) as session:
+            text = session.execute(
+                select(ConversationState.state).where(
+                    ConversationState.telegram_id == telegram_id,
+                    ConversationState.expires_at > datetime.now()
+                )
+            ).scalar()
+        return load_state(text) if text is not None else None
+
+    def set(self, telegram_id, state):
+        values = {
+            'telegram_id': telegram_id,
+            'state': dump_state(state),
+            'expires_at': datetime.now() + timedelta(seconds=self.ttl),
+        }
+        stmt = sqlite_insert(ConversationState).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ConversationState.telegram_id],
+            set_={'state': stmt.excluded.state, 'expires_at': stmt.excluded.expires_at}
+        )
+        with closing(self.session_factory()) as session:
+            session.execute(stmt)
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                session.execute(delete(ConversationState).where(ConversationState.expires_at <= datetime.now()))
+            session.commit()
+
+    def delete(self, telegram_id):
+        with closing(self.session_factory()) as session:
+            session.execute(delete(ConversationState).where(ConversationState.telegram_id == telegram_id))
+            session.commit()
+
+
+def create_state_store(config, session_factory):
+    """Хранилище из секции [STATE]: backend = memory | sqlite, ttl_seconds, max_entries"""
+    backend = config.get('STATE', 'backend', fallback='memory')
+    ttl = config.getint('STATE', 'ttl_seconds', fallback=3600)
+    if backend == 'sqlite':
+        return SqliteStateStore(session_factory, ttl=ttl)
+    if backend == 'memory':
+        return MemoryStateStore(maxsize=config.getint('STATE', 'max_entries', fallback=100000), ttl=ttl)
+    raise ValueError(f"Неизвестное хранилище состояний: {backend}")
@@ -0,0 +1,30 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория, как и для скриптов из benchmarks/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from models import Base, Category, CategoryType, User  # noqa: E402
+from sqlite_profile import create_db_engine  # noqa: E402
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Фабрика сессий новой базы в tmp_path с одним пользователем и тремя категориями"""
+    engine = create_db_engine(str(tmp_path / 'test.db'))
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        session.add(User(id=1, telegram_id=1001))
+        session.add_all([
+            Category(id=1, user_id=1, name='зарплата', type=CategoryType.income),
+            Category(id=2, user_id=1, name='кафе', type=CategoryType.expense),
+            Category(id=3, user_id=1, name='аренда', type=CategoryType.expense),
+        ])
+        session.commit()
+    yield factory
+    engine.dispose()
@@ -0,0 +1,69 @@
+# tests/test_money.py
+"""Разбор сумм в копейки и перевод старой базы с FLOAT-суммами на INTEGER."""
+import os
+import shutil
+import sqlite3
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from migrations import _column_type, upgrade_schema
+from models import Transaction
+from money import Money
+from sqlite_profile import create_db_engine
+
+BASELINE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'finance_bot.db')
+
+
+@pytest.mark.parametrize('text, kopecks', [
+    ('300', 30000),
+    ('300,50', 30050),
+    ('300.5', 30050),
+    ('1 200.75', 120075),
+    ('1\xa0200', 120000),
+    ('-5', -500),
+    ('+5', 500),
+])
+def test_parse_accepts(text, kopecks):
+    amount = Money.parse(text)
+    assert isinstance(amount, Money)
+    assert amount == kopecks
+
+
+@pytest.mark.parametrize('text', ['1e3', '12,345', '1 20', 'abc', '', '300.', '1.2.3'])
+def test_parse_rejects(text):
+    with pytest.raises(ValueError):
+        Money.parse(text)
+
+
+def test_str():
+    assert str(Money.parse('1 200,5')) == '1200.50'
+    assert str(Money(-5)) == '-0.05'
+
+
+def test_convert_amounts_to_kopecks(tmp_path):
+    # Миграция выполняется на копии: отслеживаемая база остаётся со старой схемой
+    path = str(tmp_path / 'finance_bot.db')
+    shutil.copy(BASELINE_DB, path)
+    with sqlite3.connect(path) as conn:
+        before = dict(conn.execute("SELECT id, amount FROM transactions"))
+    assert before
+
+    engine = create_db_engine(path)
+    try:
+        upgrade_schema(engine)
+        # Повторный запуск ничего не меняет
+        upgrade_schema(engine)
+        with engine.connect() as conn:
+            assert _column_type(conn, 'transactions', 'amount') == 'INTEGER'
+            assert _column_type(conn, 'daily_rollups', 'total') == 'INTEGER'
+        with Session(engine) as session:
+            after = dict(session.execute(select(Transaction.id, Transaction.amount)).all())
+    finally:
+        engine.dispose()
+
+    assert after == {row_id: round(amount * 100) for row_id, amount in before.items()}
+    assert all(isinstance(amount, Money) for amount in after.values())
+    with sqlite3.connect(path) as conn:
+        assert {kind for kind, in conn.execute("SELECT typeof(amount) FROM transactions")} == {'integer'}
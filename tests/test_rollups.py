@@ -0,0 +1,116 @@
+# tests/test_rollups.py
+"""Отчёт по дневным агрегатам против сырых сумм и согласованность агрегатов после записи."""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from models import CategoryType, MonthlySpend, Transaction
+from reports import build_report_data
+from rollups import add_to_rollups, check_rollups
+from services import save_transaction
+from write_pipeline import TransactionWriter
+
+START = datetime(2024, 1, 30)
+CATEGORIES = {1: CategoryType.income, 2: CategoryType.expense, 3: CategoryType.expense}
+
+
+def _rows(count, seed=1):
+    """Транзакции за 10 дней вокруг смены месяца, часть ровно в полночь"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        moment = START + timedelta(days=rng.randrange(10))
+        if i % 5:
+            moment += timedelta(seconds=rng.randrange(24 * 60 * 60))
+        rows.append({'user_id': 1, 'category_id': rng.choice(list(CATEGORIES)),
+                     'amount': rng.randint(1, 500000), 'date': moment})
+    return rows
+
+
+def _seed(session, rows):
+    session.execute(insert(Transaction), rows)
+    add_to_rollups(session, [(row['user_id'], row['category_id'], row['date'], row['amount']) for row in rows])
+    session.commit()
+
+
+def _raw_totals(session, start, end):
+    query = select(Transaction.category_id, func.sum(Transaction.amount), func.count()).where(
+        Transaction.user_id == 1)
+    if start is not None:
+        query = query.where(Transaction.date >= start)
+    if end is not None:
+        query = query.where(Transaction.date < end)
+    return {category_id: (total, count)
+            for category_id, total, count in session.execute(query.group_by(Transaction.category_id))}
+
+
+PERIODS = [
+    (None, None),
+    (datetime(2024, 2, 1), datetime(2024, 2, 5)),  # полные дни
+    (datetime(2024, 1, 31, 13, 30), datetime(2024, 2, 4, 8, 15)),  # оба края не в полночь
+    (datetime(2024, 2, 1), datetime(2024, 2, 3, 12)),  # только правый край
+    (datetime(2024, 2, 1, 6), datetime(2024, 2, 3)),  # только левый край
+    (datetime(2024, 2, 2, 9), datetime(2024, 2, 2, 18)),  # внутри одного дня
+    (datetime(2024, 2, 2, 9), datetime(2024, 2, 3, 1)),  # соседние дни без полных
+    (datetime(2024, 2, 3, 12), None),
+    (None, datetime(2024, 2, 2, 0, 0, 1)),
+]
+
+
+@pytest.mark.parametrize('start, end', PERIODS)
+def test_report_matches_raw_sums(session_factory, start, end):
+    with session_factory() as session:
+        _seed(session, _rows(400))
+        raw = _raw_totals(session, start, end)
+        data = build_report_data(session, 1, start, end)
+
+    names = {'зарплата': 1, 'кафе': 2, 'аренда': 3}
+    assert {names[item.name]: (item.total, item.count) for item in data.categories} == raw
+    assert data.income_total == sum(total for category_id, (total, _) in raw.items()
+                                    if CATEGORIES[category_id] == CategoryType.income)
+    assert data.expense_total == sum(total for category_id, (total, _) in raw.items()
+                                     if CATEGORIES[category_id] == CategoryType.expense)
+    assert data.tx_count == sum(count for _, count in raw.values())
+
+
+def _monthly_spend_matches(session):
+    raw = {(category_id, month): total for category_id, month, total in session.execute(
+        select(Transaction.category_id, func.date(Transaction.date, 'start of month'), func.sum(Transaction.amount))
+        .group_by(Transaction.category_id, func.date(Transaction.date, 'start of month'))
+    )}
+    stored = {(category_id, month.isoformat()): total for category_id, month, total in session.execute(
+        select(MonthlySpend.category_id, MonthlySpend.month, MonthlySpend.total)
+    )}
+    return raw == stored
+
+
+def test_check_rollups_after_save_transaction(session_factory):
+    month_totals = {}
+    with session_factory() as session:
+        for row in _rows(50, seed=2):
+            key = (row['category_id'], row['date'].year, row['date'].month)
+            month_totals[key] = month_totals.get(key, 0) + row['amount']
+            assert save_transaction(session, row) == month_totals[key]
+        assert check_rollups(session, 1) == []
+        assert _monthly_spend_matches(session)
+
+
+def test_check_rollups_after_writer_batch(session_factory):
+    rows = _rows(300, seed=3)
+    # Большая пачка: executemany с RETURNING делится на несколько операторов
+    writer = TransactionWriter(session_factory, max_batch=1000, max_latency=0.5)
+    futures = [writer.submit(row) for row in rows]
+    writer.close()
+
+    month_totals = {}
+    for row, future in zip(rows, futures):
+        key = (row['category_id'], row['date'].year, row['date'].month)
+        month_totals[key] = month_totals.get(key, 0) + row['amount']
+        assert future.result(timeout=5) == month_totals[key]
+    assert writer.batches < len(rows)
+
+    with session_factory() as session:
+        assert check_rollups(session, 1) == []
+        assert _monthly_spend_matches(session)
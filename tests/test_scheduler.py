@@ -0,0 +1,148 @@
+# tests/test_scheduler.py
+"""Куча планировщика, перечитывание задач и запись регулярных транзакций по срокам."""
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from models import RecurringRule, Transaction
+from recurring import MAX_CATCH_UP, RUN_HOUR, load_jobs, next_monthly_run, run_recurring_rules
+from rollups import check_rollups
+from scheduler import RELOAD, RETRY_DELAY, Outbox, Scheduler
+
+
+def test_next_batch_takes_earliest_due_jobs_up_to_batch_size():
+    now = datetime.now()
+    scheduler = Scheduler({}, batch_size=3)
+    for key, minutes in [(1, 5), (2, 1), (3, 4), (4, 2), (5, 3)]:
+        scheduler.schedule('a', key, now - timedelta(minutes=minutes))
+    scheduler.schedule('a', 6, now + timedelta(hours=1))
+
+    _, batch = scheduler._next_batch()
+    assert batch == {'a': {1, 3, 5}}
+    _, batch = scheduler._next_batch()
+    assert batch == {'a': {2, 4}}
+    # Задача с будущим сроком осталась в куче
+    assert len(scheduler) == 1
+
+
+def test_next_batch_groups_kinds_and_merges_duplicates():
+    due = datetime.now() - timedelta(seconds=1)
+    scheduler = Scheduler({})
+    for kind, key in [('recurring', 7), ('weekly', 1), ('recurring', 7), ('recurring', 8)]:
+        scheduler.schedule(kind, key, due)
+    _, batch = scheduler._next_batch()
+    assert batch == {'recurring': {7, 8}, 'weekly': {1}}
+
+
+def test_reload_replaces_heap_with_loader_jobs():
+    now = datetime.now()
+    jobs = [('recurring', 1, now + timedelta(days=1))]
+    scheduler = Scheduler({}, loader=lambda: list(jobs), reload_interval=timedelta(minutes=15))
+    scheduler.start()
+    try:
+        assert sorted(kind for _, kind, _ in scheduler._heap) == sorted([RELOAD, 'recurring'])
+        # Задачу добавил другой процесс, а одну запись кучи этот процесс уже снял
+        jobs.append(('weekly', 5, now + timedelta(days=2)))
+        scheduler.schedule('recurring', 2, now + timedelta(days=3))
+        assert scheduler._reload([0], now) == [(0, now + timedelta(minutes=15))]
+        assert sorted((kind, key) for _, kind, key in scheduler._heap) == [('recurring', 1), ('weekly', 5)]
+    finally:
+        scheduler.close()
+
+
+def test_run_dispatches_and_reschedules():
+    calls = []
+    done = threading.Event()
+    now = datetime.now()
+
+    def handler(keys, moment):
+        calls.append(keys)
+        done.set()
+        return [(key, moment + timedelta(days=30)) for key in keys]
+
+    def failing(keys, moment):
+        raise RuntimeError("база недоступна")
+
+    scheduler = Scheduler({'recurring': handler, 'broken': failing})
+    scheduler.schedule('broken', 9, now - timedelta(seconds=1))
+    scheduler.schedule('recurring', 2, now - timedelta(seconds=1))
+    scheduler.schedule('recurring', 1, now - timedelta(seconds=1))
+    scheduler.start()
+    try:
+        assert done.wait(5)
+    finally:
+        scheduler.close()
+
+    assert calls == [[1, 2]]
+    dues = {(kind, key): due for due, kind, key in scheduler._heap}
+    assert dues[('recurring', 1)] > now + timedelta(days=29)
+    # Упавшая пачка повторяется через RETRY_DELAY
+    assert now + RETRY_DELAY <= dues[('broken', 9)] <= datetime.now() + RETRY_DELAY
+
+
+def test_outbox_thread_starts_with_scheduler():
+    sent = []
+    outbox = Outbox(lambda chat_id, text: sent.append((chat_id, text)), rate=1000)
+    outbox.put(1, 'привет')
+    assert outbox._thread is None
+    scheduler = Scheduler({}, outbox=outbox)
+    scheduler.start()
+    scheduler.close()
+    assert sent == [(1, 'привет')]
+
+
+def test_next_monthly_run_clamps_to_short_months():
+    assert next_monthly_run(31, datetime(2024, 2, 1)) == datetime(2024, 2, 29, RUN_HOUR)
+    assert next_monthly_run(5, datetime(2024, 1, 5, RUN_HOUR)) == datetime(2024, 2, 5, RUN_HOUR)
+    assert next_monthly_run(5, datetime(2024, 12, 6)) == datetime(2025, 1, 5, RUN_HOUR)
+
+
+def _add_rule(session, next_run, day=5, amount=3000000):
+    rule = RecurringRule(user_id=1, category_id=3, amount=amount, day_of_month=day, next_run=next_run)
+    session.add(rule)
+    session.commit()
+    return rule.id
+
+
+def _dates(session, rule_amount):
+    return [date for date, in session.execute(
+        select(Transaction.date).where(Transaction.amount == rule_amount).order_by(Transaction.date))]
+
+
+def test_due_rule_inserts_one_row_and_moves_next_run(session_factory):
+    with session_factory() as session:
+        rule_id = _add_rule(session, datetime(2024, 3, 5, RUN_HOUR))
+        now = datetime(2024, 3, 5, RUN_HOUR, 0, 1)
+
+        scheduled, messages = run_recurring_rules(session, [rule_id], now)
+        assert scheduled == [(rule_id, datetime(2024, 4, 5, RUN_HOUR))]
+        assert len(messages) == 1
+        assert _dates(session, 3000000) == [datetime(2024, 3, 5, RUN_HOUR)]
+        assert session.get(RecurringRule, rule_id).next_run == datetime(2024, 4, 5, RUN_HOUR)
+
+        # Дубликат из кучи или устаревшая запись после перечитывания: правило ещё не наступило
+        assert run_recurring_rules(session, [rule_id], now) == ([], [])
+        assert len(_dates(session, 3000000)) == 1
+        assert load_jobs(session) == [('recurring', rule_id, datetime(2024, 4, 5, RUN_HOUR))]
+        assert check_rollups(session, 1) == []
+
+
+def test_rule_catches_up_missed_months(session_factory):
+    with session_factory() as session:
+        rule_id = _add_rule(session, datetime(2024, 1, 31, RUN_HOUR), day=31, amount=100)
+        scheduled, _ = run_recurring_rules(session, [rule_id], datetime(2024, 4, 10))
+        assert _dates(session, 100) == [datetime(2024, 1, 31, RUN_HOUR), datetime(2024, 2, 29, RUN_HOUR),
+                                        datetime(2024, 3, 31, RUN_HOUR)]
+        assert scheduled == [(rule_id, datetime(2024, 4, 30, RUN_HOUR))]
+        assert check_rollups(session, 1) == []
+
+
+def test_catch_up_is_limited(session_factory):
+    with session_factory() as session:
+        rule_id = _add_rule(session, datetime(2020, 1, 5, RUN_HOUR), amount=200)
+        now = datetime(2024, 3, 1)
+        scheduled, _ = run_recurring_rules(session, [rule_id], now)
+        assert len(_dates(session, 200)) == MAX_CATCH_UP
+        # После лимита срок переносится на ближайший после now, а не на следующий пропущенный месяц
+        assert scheduled == [(rule_id, datetime(2024, 3, 5, RUN_HOUR))]
@@ -0,0 +1,191 @@
+# webhook.py
+"""Режим webhook: Telegram присылает обновления POST-запросами на локальный сервер.
+
+Обновления раскладываются по очередям воркеров по chat_id: сообщения одного
+чата обрабатываются строго по порядку одним потоком, поэтому шаги мастера
+отчёта не гоняются друг с другом. Очереди ограничены; при переполнении
+сервер отвечает 503, и Telegram повторит доставку позже.
+
+Офлайн-проверка: curl -X POST -d @update.json http://127.0.0.1:8080/webhook
+Статистика очередей и задержек: curl http://127.0.0.1:8080/stats
+"""
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot.types import Update
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+# Сколько последних задержек хранить для перцентилей
+LATENCY_WINDOW = 10000
+
+
+def chat_key(update):
+    """Ключ упорядочивания: чат сообщения или пользователь callback-запроса"""
+    message = update.message or update.edited_message
+    if message is not None:
+        return message.chat.id
+    if update.callback_query is not None:
+        return update.callback_query.from_user.id
+    return update.update_id
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+class ShardedDispatcher:
+    """Пул воркеров с отдельной ограниченной очередью на каждого.
+
+    Чат всегда попадает к одному и тому же воркеру, так что порядок его
+    обновлений сохраняется, а разные чаты обрабатываются параллельно.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=256):
+        self.handler = handler
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.rejected = 0
+        self.errors = 0
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=f'webhook-worker-{i}', daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, update):
+        """Ставит обновление в очередь; False, если очередь воркера заполнена"""
+        try:
+            self._queues[hash(key) % len(self._queues)].put_nowait((update, time.perf_counter()))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+    def _run(self, updates):
+        while True:
+            item = updates.get()
+            if item is _STOP:
+                return
+            update, received = item
+            try:
+                self.handler(update)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке обновления {update.update_id}: {str(e)}")
+                with self._lock:
+                    self.errors += 1
+            with self._lock:
+                self.processed += 1
+                self._latencies.append(time.perf_counter() - received)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            processed, rejected, errors = self.processed, self.rejected, self.errors
+        depths = [q.qsize() for q in self._queues]
+        return {
+            'queue_depth': sum(depths),
+            'queue_depths': depths,
+            'processed': processed,
+            'rejected': rejected,
+            'errors': errors,
+            # Время от приёма запроса до конца обработки, по последним LATENCY_WINDOW обновлениям
+            'latency_ms': {
+                'p50': round(_percentile(latencies, 0.50) * 1000, 2),
+                'p95': round(_percentile(latencies, 0.95) * 1000, 2),
+                'p99': round(_percentile(latencies, 0.99) * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2) if latencies else 0,
+            },
+        }
+
+    def close(self):
+        """Дожидается обработки уже принятых обновлений и останавливает воркеры"""
+        for q in self._queues:
+            q.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, dispatcher, path='/webhook', secret_token=None):
+        super().__init__(address, WebhookRequestHandler)
+        self.dispatcher = dispatcher
+        self.webhook_path = path
+        self.secret_token = secret_token
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != self.server.webhook_path:
+            return self._reply(404)
+        secret = self.server.secret_token
+        if secret and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+            return self._reply(403)
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            update = Update.de_json(body.decode('utf-8'))
+        except Exception as e:
+            logger.error(f"Некорректное обновление: {str(e)}")
+            return self._reply(400)
+        # 503 — Telegram повторит доставку, очередь не растёт без предела
+        self._reply(200 if self.server.dispatcher.submit(chat_key(update), update) else 503)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._reply(404)
+        self._reply(200, json.dumps(self.server.dispatcher.stats()).encode('utf-8'), 'application/json')
+
+    def _reply(self, status, body=b'', content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Лог каждого запроса не нужен: статистика доступна на /stats
+        pass
+
+
+def create_webhook_server(bot, config):
+    """Сервер и пул воркеров из секции [WEBHOOK] для синхронного TeleBot"""
+    # Обработчики выполняются прямо в потоке воркера, а не в пуле TeleBot,
+    # иначе порядок обновлений одного чата не гарантирован
+    bot.threaded = False
+    dispatcher = ShardedDispatcher(
+        lambda update: bot.process_new_updates([update]),
+        workers=config.getint('WEBHOOK', 'workers', fallback=4),
+        queue_size=config.getint('WEBHOOK', 'queue_size', fallback=256)
+    )
+    return WebhookServer(
+        (config.get('WEBHOOK', 'host', fallback='127.0.0.1'), config.getint('WEBHOOK', 'port', fallback=8080)),
+        dispatcher,
+        path=config.get('WEBHOOK', 'path', fallback='/webhook'),
+        secret_token=config.get('WEBHOOK', 'secret_token', fallback=None) or None
+    )
+
+
+def run_webhook(bot, config):
+    server = create_webhook_server(bot, config)
+    url = config.get('WEBHOOK', 'url', fallback='')
+    if url:
+        bot.remove_webhook()
+        bot.set_webhook(url=url, secret_token=server.secret_token,
+                        max_connections=config.getint('WEBHOOK', 'max_connections', fallback=40))
+    logger.info(f"Webhook-сервер слушает {server.server_address[0]}:{server.server_address[1]}{server.webhook_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.dispatcher.close()
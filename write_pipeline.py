@@ -0,0 +1,100 @@
+# write_pipeline.py
+from concurrent.futures import Future
+from contextlib import closing
+from sqlalchemy import insert
+from models import Transaction
+from rollups import add_to_rollups
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class TransactionWriter:
+    """Фоновая запись транзакций групповыми коммитами.
+
+    Обработчики ставят готовые строки в очередь и получают Future, который
+    завершается только после коммита пачки. Один поток-писатель собирает пачку
+    до max_batch строк или до истечения max_latency секунд с первой строки
+    и фиксирует её одним коммитом (одна синхронизация диска на пачку).
+    """
+
+    def __init__(self, session_factory, max_batch=200, max_latency=0.005, on_commit=None):
+        self.session_factory = session_factory
+        self.on_commit = on_commit  # вызывается со списком строк после коммита пачки
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.rows = 0
+        self._thread = threading.Thread(target=self._run, name='transaction-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        """Ставит строку {user_id, category_id, amount, date} в очередь на запись.
+
+        Результат Future — сумма месяца по категории строки после её записи.
+        """
+        future = Future()
+        self._queue.put((row, future))
+        return future
+
+    def close(self):
+        """Дописывает очередь и останавливает поток-писатель"""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency
+            stop = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+            if stop:
+                return
+
+    def _flush(self, batch):
+        rows = [row for row, _ in batch]
+        try:
+            with closing(self.session_factory()) as session:
+                session.execute(insert(Transaction), rows)
+                month_totals = add_to_rollups(session, [
+                    (row['user_id'], row['category_id'], row['date'], row['amount']) for row in rows
+                ])
+                session.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при групповой записи {len(rows)} транзакций: {str(e)}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.rows += len(rows)
+        if self.on_commit:
+            try:
+                self.on_commit(rows)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике коммита пачки: {str(e)}")
+        for (_, future), month_total in zip(batch, month_totals):
+            future.set_result(month_total)